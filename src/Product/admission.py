@@ -0,0 +1,96 @@
+import math
+import time
+from collections import OrderedDict
+
+
+class Rejected(Exception):
+    """
+    Request rejected before it reaches the model, so that the service answers quickly instead of
+    queueing without limit when it is overloaded.
+
+    Args:
+        reason (str): Why the request was rejected ("rate_limit", "overloaded", "deadline" or "disconnected").
+        status (int): HTTP status code of the response (429 or 503).
+        retry_after (int): Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class RateLimiter:
+    """
+    Token bucket rate limit per client. Every client can send a burst of requests and then
+    one request every 1 / rate seconds. Only the most recent clients are kept, the buckets
+    of the others are full anyway once they have been idle for burst / rate seconds.
+
+    Args:
+        rate (float): Requests per second allowed to every client, 0 disables the limit.
+        burst (int, optional): Requests a client can send at once (default is 20).
+        max_clients (int, optional): Maximum number of clients whose bucket is kept (default is 10000).
+    """
+
+    def __init__(self, rate, burst=20, max_clients=10000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+
+    def check(self, client):
+        """
+        Takes a token from the bucket of a client.
+
+        Args:
+            client (str): Identifier of the client.
+
+        Raises:
+            Rejected: If the client has no tokens left, with the seconds until the next one.
+        """
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        tokens, last = self.buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[client] = (tokens, now)
+            raise Rejected("rate_limit", 429, (1 - tokens) / self.rate)
+        self.buckets[client] = (tokens - 1, now)
+        while len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+
+
+def client_key(request, header=None):
+    """
+    Args:
+        request (Request): The request.
+        header (str, optional): Header that identifies the client, for instance "X-Forwarded-For"
+            behind a proxy (default is None, the address of the connection).
+
+    Returns:
+        str: Identifier of the client of the request.
+    """
+    if header and request.headers.get(header):
+        return request.headers[header].split(",")[0].strip()
+    return request.client.host if request.client is not None else "unknown"
+
+
+def deadline(request, timeout):
+    """
+    Time after which the client of a request is no longer waiting for the answer. Clients can
+    shorten the timeout of the service with the X-Request-Timeout header, in seconds.
+
+    Args:
+        request (Request): The request.
+        timeout (float): Maximum seconds a request waits for the model.
+
+    Returns:
+        float: The deadline, on the clock of time.monotonic.
+    """
+    try:
+        timeout = min(timeout, float(request.headers.get("x-request-timeout", timeout)))
+    except ValueError:
+        pass
+    return time.monotonic() + timeout
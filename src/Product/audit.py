@@ -0,0 +1,387 @@
+import asyncio
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from admission import Rejected
+from metrics import Metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Folder, inside the folder of the log, where the batches that could not be written are kept
+SPILL_DIR = "spill"
+
+
+def init_logger():
+    """
+    Sources the R modules of the audit log in the logger process. Its R interpreter is the
+    only one that writes the log segments, the monitor checkpoint and the aggregates.
+    """
+    import pyCBA
+
+
+def written_ids(directory, count):
+    """
+    Reads the IDs of the last records of the most recent segment of the log, reading the
+    segment backwards from its end.
+
+    Args:
+        directory (str): Folder of the log.
+        count (int): Number of records to read.
+
+    Returns:
+        set: IDs of the last records, without the records written before the IDs were logged.
+    """
+    segments = sorted(glob.glob(os.path.join(directory, "log_*.jsonl")))
+    if not segments or count <= 0:
+        return set()
+    with open(segments[-1], "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            step = min(1 << 16, position)
+            position -= step
+            f.seek(position)
+            data = f.read(end - position)
+    ids = set()
+    for line in data.splitlines()[-count:]:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # The first line read may be cut, and a crash may leave the last one partial
+            continue
+        record_id = record.get("id") if isinstance(record, dict) else None
+        if isinstance(record_id, list):
+            record_id = record_id[0] if record_id else None
+        if record_id is not None:
+            ids.add(record_id)
+    return ids
+
+
+def unwritten(batch, directory):
+    """
+    Removes from a batch the predictions already written to the log, so that a batch written
+    again after a failure is not duplicated.
+
+    Args:
+        batch (list): Predictions queued by AuditLog.submit.
+        directory (str): Folder of the log.
+
+    Returns:
+        list: The batch without the predictions whose ID is in the log.
+    """
+    written = written_ids(directory, sum(len(b[0]) for b in batch))
+    if not written:
+        return batch
+    remaining = []
+    for to_predict, predictions, rules, version, times, ids in batch:
+        keep = [i for i, record_id in enumerate(ids) if record_id not in written]
+        if keep:
+            remaining.append((to_predict.iloc[keep].reset_index(drop=True), [predictions[i] for i in keep],
+                              [rules[i] for i in keep], version, [times[i] for i in keep], [ids[i] for i in keep]))
+    return remaining
+
+
+def write_records(batch, directory=None):
+    """
+    Writes a batch of predictions to the audit log inside the logger process, with one call
+    to R for every run of consecutive predictions of the same model version.
+
+    Args:
+        batch (list): Applications, predictions, rule IDs, model versions, decision times and
+            record IDs queued by AuditLog.submit.
+        directory (str, optional): Folder of the log. If it is given, the predictions already
+            written there are skipped (default is None, the whole batch is written).
+
+    Returns:
+        list: Timing spans of the write, as pairs of stage and duration in seconds.
+    """
+    import pyCBA
+    start = time.perf_counter()
+    if directory is not None:
+        batch = unwritten(batch, directory)
+    i = 0
+    while i < len(batch):
+        j = i + 1
+        while j < len(batch) and batch[j][3] == batch[i][3]:
+            j += 1
+        group = batch[i:j]
+        pyCBA.log_many(pd.concat([b[0] for b in group], ignore_index=True),
+                       [p for b in group for p in b[1]], [r for b in group for r in b[2]], group[0][3],
+                       times=[t for b in group for t in b[4]], ids=[x for b in group for x in b[5]])
+        i = j
+    spans = [("log", time.perf_counter() - start)]
+    return spans + [("r_" + stage, seconds) for stage, seconds in pyCBA.drain_spans()]
+
+
+def close_records():
+    """
+    Saves the aggregates and the monitor state and closes the active segment inside the logger process.
+    """
+    import pyCBA
+    pyCBA.close_log()
+
+
+def spill(batch, path):
+    """
+    Saves a batch that could not be written to the log as JSON Lines, synced to disk.
+
+    Args:
+        batch (list): Predictions queued by AuditLog.submit.
+        path (str): File path of the spill file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for to_predict, predictions, rules, version, times, ids in batch:
+            for i, row in enumerate(to_predict.to_dict(orient="records")):
+                f.write(json.dumps({"id": ids[i], "time": times[i], "version": version, "input": row,
+                                    "output": predictions[i], "rules": list(rules[i])}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + ".tmp", path)
+
+
+def read_spill(path):
+    """
+    Reads a file written by spill.
+
+    Args:
+        path (str): File path of the spill file.
+
+    Returns:
+        list: The predictions of the file, in the form queued by AuditLog.submit.
+    """
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            batch.append((pd.DataFrame([record["input"]]), [record["output"]], [record["rules"]],
+                          record["version"], [record["time"]], [record["id"]]))
+    return batch
+
+
+class AuditLog:
+    """
+    Single writer of the audit log. The predictions of all the worker processes and the cached
+    decisions are written in batches through one dedicated logger process, so the log segments
+    are appended by a single R connection and the monitor and the aggregates see all the traffic
+    in one state.
+
+    The log is mandatory: a request waits until its predictions are durable before it is answered.
+    The predictions that arrive while a batch is being written are written together in the next
+    one. A batch that cannot be written is retried, and then spilled to disk and written again once
+    the logger works, skipping the predictions that reached the log before the failure.
+
+    Args:
+        metrics (Metrics, optional): Metrics where the timing spans of the writes are observed (default is a new one).
+        batch_size (int, optional): Maximum predictions written at once (default is 256).
+        max_pending (int, optional): Maximum predictions waiting to be written, new ones wait for room (default is 4096).
+        retries (int, optional): Times a failed batch is written again before it is spilled to disk (default is 3).
+        directory (str, optional): Folder of the log, where R writes the segments (default is "log").
+    """
+
+    def __init__(self, metrics=None, batch_size=256, max_pending=4096, retries=3, directory="log"):
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.retries = retries
+        self.directory = directory
+        self.executor = None
+        self.pending = []
+        self.queued = 0
+        self.ready = None
+        self.space = None
+        self.task = None
+        self.stopping = False
+        self.healthy = True
+        self.written = 0
+        self.spilled = 0
+        self.restarts = 0
+
+    def start_logger(self):
+        """
+        Starts the logger process.
+        """
+        # R cannot be forked safely, the logger starts a fresh interpreter
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_logger)
+
+    def start(self):
+        """
+        Starts the logger process and the background task that writes the batches. Meant to be
+        called from the event loop.
+        """
+        self.start_logger()
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        # Batches spilled before the last stop
+        if self.spill_files():
+            self.ready.set()
+
+    async def submit(self, to_predict, predictions, rules, version, deadline=None):
+        """
+        Queues predictions to be written to the audit log and waits until they are durable.
+        The time of the decisions is taken when they are queued, not when they are written.
+
+        Args:
+            to_predict (DataFrame): Data of the predictions, one row per application.
+            predictions (list): Prediction of every row.
+            rules (list): Stable IDs of the rules used for every row (see npCBA.rule_keys).
+            version (str): Version of the model that made the predictions.
+            deadline (float, optional): Time, on the clock of time.monotonic, after which the request
+                stops waiting for room in the queue (default is None, no deadline).
+
+        Raises:
+            Rejected: If the queue had no room before the deadline, or if the predictions could be
+                neither written nor spilled to disk.
+        """
+        n = len(to_predict)
+        now = time.time()
+        # Backpressure: the requests wait while the log is behind
+        while self.queued > 0 and self.queued + n > self.max_pending:
+            self.space.clear()
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                raise Rejected("log_queue", 503, 1)
+            try:
+                await asyncio.wait_for(self.space.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise Rejected("log_queue", 503, 1)
+
+        done = asyncio.get_running_loop().create_future()
+        self.pending.append(((to_predict.reset_index(drop=True), [str(p) for p in predictions], rules, str(version),
+                              [now] * n, [uuid.uuid4().hex for _ in range(n)]), done))
+        self.queued += n
+        self.ready.set()
+        # The write goes on if the client disconnects
+        await asyncio.shield(done)
+
+    async def write(self, batch):
+        """
+        Writes a batch of predictions. If the logger process crashes, it is restarted, and any
+        failure is retried, skipping the predictions that were already written.
+
+        Args:
+            batch (list): Predictions queued by submit.
+
+        Returns:
+            bool: Whether the batch was written.
+        """
+        n = sum(len(b[0]) for b in batch)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+            executor = self.executor
+            try:
+                spans = await asyncio.wrap_future(executor.submit(write_records, batch,
+                                                                  self.directory if attempt > 0 else None))
+                self.metrics.observe_spans(spans)
+                self.written += n
+                self.healthy = True
+                return True
+            except BrokenProcessPool:
+                logger.exception("The logger process crashed while writing %d predictions", n)
+                if executor is self.executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.restarts += 1
+                    self.start_logger()
+            except Exception:
+                logger.exception("%d predictions could not be written to the audit log", n)
+        self.healthy = False
+        return False
+
+    def spill_files(self):
+        """
+        Returns:
+            list: Spill files waiting to be written to the log, oldest first.
+        """
+        return sorted(glob.glob(os.path.join(self.directory, SPILL_DIR, "*.jsonl")))
+
+    async def replay(self):
+        """
+        Writes to the log the batches spilled to disk, removing every file once it is written.
+        """
+        loop = asyncio.get_running_loop()
+        for path in self.spill_files():
+            batch = await loop.run_in_executor(None, read_spill, path)
+            if not await self.write(batch):
+                return
+            os.remove(path)
+
+    async def flush(self):
+        """
+        Writes the oldest queued predictions, up to batch_size of them, and tells their requests
+        whether they are durable. A batch that cannot be written is spilled to disk.
+        """
+        entries, n = [], 0
+        while self.pending and (not entries or n + len(self.pending[0][0][0]) <= self.batch_size):
+            entry = self.pending.pop(0)
+            entries.append(entry)
+            n += len(entry[0][0])
+        self.queued -= n
+        self.space.set()
+        batch = [entry for entry, _ in entries]
+
+        error = None
+        if not await self.write(batch):
+            path = os.path.join(self.directory, SPILL_DIR, "%d_%s.jsonl" % (time.time_ns(), uuid.uuid4().hex))
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, spill, batch, path)
+                self.spilled += n
+                self.metrics.inc("xai_log_spilled_total", n)
+            except OSError:
+                logger.exception("%d predictions could not be spilled to disk", n)
+                self.metrics.inc("xai_log_failed_total", n)
+                error = Rejected("audit_log", 503, 1)
+        for _, done in entries:
+            if done.done():
+                continue
+            if error is None:
+                done.set_result(None)
+            else:
+                done.set_exception(error)
+
+    async def run(self):
+        """
+        Writes the queued predictions as they arrive until the log is stopped, and the spilled
+        batches whenever the logger works again.
+        """
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.pending:
+                await self.flush()
+            # The spilled batches are written once the last batch reached the log
+            if self.healthy and self.spill_files():
+                await self.replay()
+            if self.stopping:
+                return
+
+    async def stop(self):
+        """
+        Writes the predictions still queued, saves the state of the log and stops the logger process.
+        """
+        self.stopping = True
+        self.ready.set()
+        await self.task
+        try:
+            await asyncio.wrap_future(self.executor.submit(close_records))
+        finally:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: Predictions queued, written and spilled to disk, and restarts of the logger process.
+        """
+        return {"queued": self.queued, "written": self.written, "spilled": self.spilled, "restarts": self.restarts}
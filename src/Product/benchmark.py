@@ -0,0 +1,495 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+import pandas as pd
+
+
+# Data the service is built from, the applicants are sampled from its levels
+DATA = "../data/Statlog_rCBA.csv"
+
+# Percentiles reported for every benchmark
+PERCENTILES = [50, 95, 99]
+
+# Fields of the form of /sendApplication for every column of the data
+FORM_FIELDS = {
+    'Status.of.existing.checking.account': 'status',
+    'Duration.in.month': 'duration',
+    'Credit.history': 'credit_history',
+    'Purpose': 'purpose',
+    'Credit.amount': 'credit_amount',
+    'Savings.account.bonds': 'savings',
+    'Present.employment.since': 'employment_since',
+    'Installment.rate.in.percentage.of.disposable.income': 'installment_rate',
+    'Other.debtors...guarantors': 'debtors',
+    'Present.residence.since': 'residence_since',
+    'Property': 'property',
+    'Age.in.years': 'age',
+    'Other.installment.plans': 'other_plans',
+    'Housing': 'housing',
+    'Number.of.existing.credits.at.this.bank': 'existing_credits',
+    'Job': 'job',
+    'Number.of.people.being.liable.to.provide.maintenance.for': 'maintenance_people',
+    'Telephone': 'telephone',
+    'Foreign.worker': 'foreign_worker',
+    'Gender': 'gender',
+    'Marital.Status': 'marital_status',
+}
+
+
+def generate_applicants(data, n, seed=0):
+    """
+    Generates synthetic applicants whose attributes take valid levels of the data. Every attribute
+    is sampled independently with the frequencies of its levels, so the applicants include
+    combinations that are not in the data, as new applications would.
+
+    Args:
+        data (str): File path of the filtered data.
+        n (int): Number of applicants.
+        seed (int, optional): Seed of the random generator, the same seed gives the same applicants (default is 0).
+
+    Returns:
+        DataFrame: The applicants, one row per applicant, with the columns of the form of the API.
+    """
+    rng = np.random.default_rng(seed)
+    data = pd.read_csv(data, dtype=str)
+    applicants = {}
+    for column in FORM_FIELDS:
+        levels = data[column].value_counts()
+        applicants[column] = rng.choice(levels.index.to_numpy(), size=n, p=(levels / levels.sum()).to_numpy())
+    return pd.DataFrame(applicants)
+
+
+def summarize(name, times, elapsed=None, **params):
+    """
+    Summarizes the latencies of a benchmark.
+
+    Args:
+        name (str): Name of the benchmark.
+        times (list): Latency of every call, in seconds.
+        elapsed (float, optional): Wall time of all the calls, in seconds. If it is None, the calls
+            are taken as sequential and it is the sum of the latencies (default is None).
+        **params: Parameters of the benchmark, reported with the results.
+
+    Returns:
+        dict: Number of calls, mean and percentiles of the latency in milliseconds and throughput in calls per second.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    elapsed = times.sum() if elapsed is None else elapsed
+    result = {"name": name, **params, "n": len(times), "mean_ms": float(times.mean() * 1000) if len(times) else None}
+    for percentile in PERCENTILES:
+        result["p%d_ms" % percentile] = float(np.percentile(times, percentile) * 1000) if len(times) else None
+    result["throughput_per_s"] = float(len(times) / elapsed) if elapsed > 0 else None
+    print("%-40s n=%-6d p50=%9.3f ms  p95=%9.3f ms  p99=%9.3f ms  %10.1f/s"
+          % (name, len(times), *[result["p%d_ms" % p] or 0 for p in PERCENTILES], result["throughput_per_s"] or 0))
+    return result
+
+
+def measure(func, args_list, warmup=1):
+    """
+    Times a function called once for every set of arguments.
+
+    Args:
+        func (callable): Function to time.
+        args_list (list): Arguments of every call, as tuples.
+        warmup (int, optional): Number of untimed calls made first with the first arguments (default is 1).
+
+    Returns:
+        list: Latency of every call, in seconds.
+    """
+    for _ in range(warmup):
+        func(*args_list[0])
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def configure_log(directory):
+    """
+    Sends the audit log, the aggregates and the monitor checkpoint of the R interpreter to a directory,
+    so that the benchmarks do not write to the log of the service.
+
+    Args:
+        directory (str): Directory of the log.
+
+    Returns:
+        str: Path of the active log segment, once the first record is written.
+    """
+    import rpy2.robjects as robjects
+    robjects.r['log_config'](dir=directory)
+    robjects.r['aggregate_config'](dir=os.path.join(directory, "aggregates"))
+    robjects.r['monitor_config'](checkpoint_file=os.path.join(directory, "monitor.rds"))
+    return os.path.join(directory, "log_" + time.strftime("%Y-%m-%d") + ".jsonl")
+
+
+def rule_count(classifier):
+    """
+    Args:
+        classifier (rpy2 object): Classifier returned by init_model.
+
+    Returns:
+        int: Number of rules of the classifier.
+    """
+    import rpy2.robjects as robjects
+    return int(robjects.r['length'](classifier.rx2('rules'))[0])
+
+
+def micro_benchmarks(args, applicants):
+    """
+    Times init_model (mining the rules and loading the snapshot), predict_model with and without
+    the rules in R and in npCBA, log and detect_consecutive, one applicant per call.
+
+    Args:
+        args (Namespace): Arguments of the command line.
+        applicants (DataFrame): Synthetic applicants.
+
+    Returns:
+        list: Summary of every benchmark.
+    """
+    import rpy2.robjects as robjects
+    import npCBA
+    import pyCBA
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="xai_benchmark_")
+    try:
+        model_args = (args.data, args.train_size, args.support, args.confidence)
+        init = robjects.r['init_model']
+
+        # Every cold start mines the rules into an empty snapshot directory
+        dirs = [(os.path.join(workdir, "cold_%d" % i),) for i in range(args.init_repeat)]
+        times = measure(lambda d: init(*model_args, snapshot_dir=d), dirs, warmup=0)
+        results.append(summarize("init_model (mine)", times, support=args.support, confidence=args.confidence))
+        times = measure(lambda d: init(*model_args, snapshot_dir=d), dirs, warmup=0)
+        results.append(summarize("init_model (snapshot)", times, support=args.support, confidence=args.confidence))
+
+        classifier = init(*model_args, snapshot_dir=dirs[0][0])
+        rows = [(applicants.iloc[[i]],) for i in range(len(applicants))]
+        for get_rules in (False, True):
+            times = measure(lambda row: pyCBA.predict_model(classifier, row, get_rules), rows)
+            results.append(summarize("predict_model R (get_rules=%s)" % get_rules, times, rules=rule_count(classifier)))
+
+        # Engine of the service workers
+        pyCBA.export_model(classifier, os.path.join(workdir, "engine"))
+        model = npCBA.load_model(os.path.join(workdir, "engine"))
+        for get_rules in (False, True):
+            times = measure(lambda row: npCBA.predict_model(model, row, get_rules), rows)
+            results.append(summarize("predict_model npCBA (get_rules=%s)" % get_rules, times, rules=rule_count(classifier)))
+        times = measure(lambda: npCBA.predict_model(model, applicants, True), [()] * args.batch_repeat)
+        results.append(summarize("predict_model npCBA (batch)", times, batch=len(applicants)))
+
+        # Audit log of the predictions
+        log_file = configure_log(os.path.join(workdir, "log"))
+        decisions = [(row, *pyCBA.predict_model(classifier, row, True)) for (row,) in rows]
+        times = measure(pyCBA.log_prediction, decisions)
+        results.append(summarize("log", times))
+        times = measure(robjects.r['detect_consecutive'], [(log_file,)] * args.detect_repeat)
+        results.append(summarize("detect_consecutive", times, log_records=len(decisions) + 1))
+        robjects.r['log_close']()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def rule_sweep(args, applicants):
+    """
+    Times predict_model for classifiers of different sizes, mined with every pair of support and confidence.
+
+    Args:
+        args (Namespace): Arguments of the command line.
+        applicants (DataFrame): Synthetic applicants.
+
+    Returns:
+        list: Summary of every pair of support and confidence.
+    """
+    import rpy2.robjects as robjects
+    import npCBA
+    import pyCBA
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="xai_benchmark_")
+    try:
+        rows = [(applicants.iloc[[i]],) for i in range(len(applicants))]
+        for support in args.supports:
+            for confidence in args.confidences:
+                classifier = robjects.r['init_model'](args.data, args.train_size, support, confidence, snapshot_dir=workdir)
+                params = dict(support=support, confidence=confidence, rules=rule_count(classifier))
+                times = measure(lambda row: pyCBA.predict_model(classifier, row, True), rows)
+                results.append(summarize("sweep predict_model R", times, **params))
+                path = os.path.join(workdir, "engine_%s_%s" % (support, confidence))
+                pyCBA.export_model(classifier, path)
+                model = npCBA.load_model(path)
+                times = measure(lambda row: npCBA.predict_model(model, row, True), rows)
+                results.append(summarize("sweep predict_model npCBA", times, **params))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def log_sweep(args, applicants):
+    """
+    Times log and detect_consecutive with log segments of different sizes. Every segment is
+    filled with copies of a logged record before the calls are timed.
+
+    Args:
+        args (Namespace): Arguments of the command line.
+        applicants (DataFrame): Synthetic applicants.
+
+    Returns:
+        list: Summary of every log size.
+    """
+    import rpy2.robjects as robjects
+    import pyCBA
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="xai_benchmark_")
+    try:
+        classifier = robjects.r['init_model'](args.data, args.train_size, args.support, args.confidence,
+                                              snapshot_dir=os.path.join(workdir, "models"))
+        rows = [(applicants.iloc[[i]],) for i in range(len(applicants))]
+        decisions = [(row, *pyCBA.predict_model(classifier, row, True)) for (row,) in rows]
+        for size in args.log_sizes:
+            log_file = configure_log(os.path.join(workdir, "log_%d" % size))
+            pyCBA.log_prediction(*decisions[0])
+            robjects.r['log_close']()
+            with open(log_file, encoding="utf-8") as f:
+                record = f.readline()
+            with open(log_file, "a", encoding="utf-8") as f:
+                f.writelines([record] * max(0, size - 1))
+
+            times = measure(pyCBA.log_prediction, decisions, warmup=0)
+            results.append(summarize("sweep log", times, log_records=size))
+            times = measure(robjects.r['detect_consecutive'], [(log_file,)] * args.detect_repeat, warmup=0)
+            results.append(summarize("sweep detect_consecutive", times, log_records=size + len(decisions)))
+            robjects.r['log_close']()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def start_server(port, env=None, timeout=600):
+    """
+    Starts a local uvicorn instance of the API and waits until its workers answer.
+
+    Args:
+        port (int): Port of the server.
+        env (dict, optional): Environment variables added to the ones of this process (default is None).
+        timeout (float, optional): Seconds to wait for the model to be built and the workers to start (default is 600).
+
+    Returns:
+        Popen: The process of the server.
+    """
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env={**os.environ, **(env or {})},
+                              stdout=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited with code %d" % server.returncode)
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%d/health" % port, timeout=5) as response:
+                if response.status == 200:
+                    return server
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.5)
+    server.kill()
+    raise RuntimeError("The server did not start in %d seconds" % timeout)
+
+
+def load_test(url, applicants, requests, concurrency, cache="off"):
+    """
+    Sends applications to /sendApplication from several concurrent clients, each one waiting
+    for its answer before sending the next application.
+
+    Args:
+        url (str): Base URL of the API.
+        applicants (DataFrame): Synthetic applicants, sent in turn (again from the first one if
+            there are fewer applicants than requests).
+        requests (int): Total number of requests.
+        concurrency (int): Number of concurrent clients.
+        cache (str, optional): Scenario reported with the results: "off" for a server without the
+            decision cache, "on" for repeated applicants answered from the cache (default is "off").
+
+    Returns:
+        dict: Summary of the latencies of the successful requests, with the number of errors.
+    """
+    bodies = [urllib.parse.urlencode({FORM_FIELDS[column]: value for column, value in row.items()}).encode()
+              for row in applicants.to_dict("records")]
+    times = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            request = urllib.request.Request(url.rstrip("/") + "/sendApplication", data=bodies[i % len(bodies)],
+                                             headers={"Content-Type": "application/x-www-form-urlencoded"})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    times.append(elapsed)
+            except (urllib.error.URLError, ConnectionError, TimeoutError) as error:
+                with lock:
+                    errors.append(getattr(error, "code", None) or type(error).__name__)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    name = "load /sendApplication" if cache == "off" else "load /sendApplication (cache)"
+    result = summarize(name, times, elapsed, concurrency=concurrency, cache=cache)
+    result["errors"] = len(errors)
+    result["error_types"] = {str(e): errors.count(e) for e in set(errors)}
+    return result
+
+
+def run_info():
+    """
+    Returns:
+        dict: Commit, time and machine of the run, so that results of different commits can be compared.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def compare(baseline, candidate, threshold=0.1):
+    """
+    Compares the percentiles of two result files, matching the benchmarks by name and parameters.
+
+    Args:
+        baseline (str): Result file of the reference commit.
+        candidate (str): Result file of the new commit.
+        threshold (float, optional): Relative increase of the p95 reported as a regression (default is 0.1).
+
+    Returns:
+        int: Number of regressions.
+    """
+    def key(result):
+        return tuple(sorted((k, str(v)) for k, v in result.items()
+                            if k not in ("n", "mean_ms", "throughput_per_s", "errors", "error_types")
+                            and not k.startswith("p")))
+
+    with open(baseline) as f:
+        before = {key(r): r for r in json.load(f)["results"]}
+    with open(candidate) as f:
+        after = json.load(f)["results"]
+
+    regressions = 0
+    for result in after:
+        old = before.get(key(result))
+        if old is None or not old["p95_ms"]:
+            continue
+        change = result["p95_ms"] / old["p95_ms"] - 1
+        regressed = change > threshold
+        regressions += regressed
+        print("%-40s p95 %9.3f -> %9.3f ms (%+6.1f%%)%s" % (result["name"], old["p95_ms"], result["p95_ms"],
+                                                          change * 100, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmarks of the scoring service.")
+    parser.add_argument("suites", nargs="*", default=["micro"],
+                        choices=["micro", "rules", "log", "load", "generate", "compare"],
+                        help="Benchmarks to run (default is micro)")
+    parser.add_argument("--data", default=DATA)
+    parser.add_argument("--train-size", type=float, default=0.7)
+    parser.add_argument("--support", type=float, default=0.01)
+    parser.add_argument("--confidence", type=float, default=0.01)
+    parser.add_argument("--applicants", type=int, default=200, help="Number of synthetic applicants")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--init-repeat", type=int, default=3)
+    parser.add_argument("--batch-repeat", type=int, default=20)
+    parser.add_argument("--detect-repeat", type=int, default=20)
+    parser.add_argument("--supports", type=float, nargs="+", default=[0.05, 0.02, 0.01, 0.005])
+    parser.add_argument("--confidences", type=float, nargs="+", default=[0.01, 0.5])
+    parser.add_argument("--log-sizes", type=int, nargs="+", default=[0, 1000, 10000, 100000])
+    parser.add_argument("--url", help="Base URL of a running API, a local uvicorn instance is started otherwise")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--cache", nargs="+", choices=["off", "on"], default=["off", "on"],
+                        help="Load scenarios: distinct applicants without the decision cache (off), and the "
+                             "--applicants applicants repeated with the cache (on)")
+    parser.add_argument("--server-env", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="Environment of the local server, for example XAI_WORKERS=4")
+    parser.add_argument("--output", help="File where the results are written as JSON")
+    parser.add_argument("--baseline", help="Result file compared with --output by the compare suite")
+    args = parser.parse_args()
+
+    if "compare" in args.suites:
+        sys.exit(1 if compare(args.baseline, args.output) else 0)
+
+    applicants = generate_applicants(args.data, args.applicants, args.seed)
+    if "generate" in args.suites:
+        applicants.to_csv(args.output or sys.stdout, index=False)
+        return
+
+    results = []
+    if "micro" in args.suites:
+        results += micro_benchmarks(args, applicants)
+    if "rules" in args.suites:
+        results += rule_sweep(args, applicants)
+    if "log" in args.suites:
+        results += log_sweep(args, applicants)
+    if "load" in args.suites:
+        server_env = dict(item.split("=", 1) for item in args.server_env)
+        for cache in args.cache:
+            server = None
+            if args.url is None:
+                # Without the cache every request reaches the workers
+                server = start_server(args.port, {"XAI_CACHE_SIZE": "0", **server_env} if cache == "off" else server_env)
+            try:
+                for i, concurrency in enumerate(args.concurrency):
+                    # A new applicant for every request, as new applications would be, so that a server
+                    # given with --url does not answer them from its cache either
+                    load_applicants = applicants if cache == "on" else \
+                        generate_applicants(args.data, args.requests, args.seed + 1 + i)
+                    results.append(load_test(args.url or "http://127.0.0.1:%d" % args.port, load_applicants,
+                                             args.requests, concurrency, cache))
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+
+    output = {"run": {**run_info(), "args": vars(args)}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
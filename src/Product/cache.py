@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of the decisions of the model. The model is deterministic and every
+    attribute takes one of a fixed list of levels, so the same profile always gets the same
+    prediction and rules from the same model version.
+
+    Args:
+        maxsize (int, optional): Maximum number of profiles kept, 0 disables the cache (default is 10000).
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(to_predict):
+        """
+        Canonical key of a one-row application. The values are converted to text exactly as
+        npCBA.encode does, without any other normalization, so two applications share a key
+        only if the model sees the same values.
+
+        Args:
+            to_predict (DataFrame): One-row DataFrame with the application.
+
+        Returns:
+            tuple: Pairs of column name and value, sorted by column name.
+        """
+        return tuple((column, to_predict[column].astype(str).iloc[0]) for column in sorted(to_predict.columns))
+
+    def check_version(self, version):
+        """
+        Empties the cache when the model version changes.
+
+        Args:
+            version (str): Version of the loaded model.
+        """
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, version, key):
+        """
+        Args:
+            version (str): Version of the loaded model.
+            key (tuple): Key returned by DecisionCache.key.
+
+        Returns:
+            The cached decision, or None if the profile is not cached.
+        """
+        self.check_version(version)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, version, key, decision):
+        """
+        Args:
+            version (str): Version of the model that made the decision.
+            key (tuple): Key returned by DecisionCache.key.
+            decision: Decision to cache.
+        """
+        if self.maxsize <= 0:
+            return
+        self.check_version(version)
+        self.entries[key] = decision
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size, hits, misses and hit ratio of the cache.
+        """
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0}
@@ -0,0 +1,119 @@
+import json
+import re
+import numpy as np
+import pandas as pd
+from npCBA import BINS_PREFIX
+
+
+# Label given by cut (after format_adapter) to an interval open on the left and closed on the right
+INTERVAL = re.compile(r"^\((.+)~(.+)\]$")
+
+
+def load_discretizer(path):
+    """
+    Loads a discretizer saved by save_discretizer in R.
+
+    Args:
+        path (str): File path of the JSON file.
+
+    Returns:
+        dict: The bin edges and labels of every numeric attribute, as arrays.
+    """
+    with open(path) as f:
+        bins = json.load(f)
+    return {column: (np.asarray(b['edges'], dtype=np.float64), np.asarray(b['labels'], dtype=str))
+            for column, b in bins.items()}
+
+
+def from_labels(item_labels):
+    """
+    Rebuilds a discretizer from the interval labels of the items of a model, for models whose
+    discretizer was not saved. The edges are only as precise as the labels (three significant digits).
+
+    Args:
+        item_labels (list): Labels ("attribute=value") of the items of the model.
+
+    Returns:
+        dict: The bin edges and labels of every attribute whose values are all intervals.
+    """
+    values = {}
+    for label in item_labels:
+        attribute, value = str(label).split("=", 1)
+        values.setdefault(attribute, []).append(value)
+
+    bins = {}
+    for attribute, labels in values.items():
+        intervals = [INTERVAL.match(label) for label in labels]
+        if not all(intervals):
+            continue
+        try:
+            bounds = sorted((float(m.group(1)), float(m.group(2)), label) for m, label in zip(intervals, labels))
+        except ValueError:
+            continue
+        edges = [bounds[0][0]] + [upper for _, upper, _ in bounds]
+        bins[attribute] = (np.asarray(edges, dtype=np.float64), np.asarray([label for _, _, label in bounds], dtype=str))
+
+    return bins
+
+
+def to_arrays(bins):
+    """
+    Args:
+        bins (dict): Discretizer returned by load_discretizer or from_labels.
+
+    Returns:
+        dict: The arrays of the discretizer, to be saved with the model by npCBA.save_model.
+    """
+    arrays = {BINS_PREFIX + "columns": np.asarray(list(bins), dtype=str)}
+    for column, (edges, labels) in bins.items():
+        arrays[BINS_PREFIX + column + ".edges"] = edges
+        arrays[BINS_PREFIX + column + ".labels"] = labels
+    return arrays
+
+
+def from_model(model):
+    """
+    Args:
+        model (dict): Model returned by npCBA.load_model.
+
+    Returns:
+        dict: The discretizer saved with the model, empty if it has none.
+    """
+    if BINS_PREFIX + "columns" not in model:
+        return {}
+    return {str(column): (model[BINS_PREFIX + column + ".edges"], model[BINS_PREFIX + column + ".labels"])
+            for column in model[BINS_PREFIX + "columns"]}
+
+
+def discretize(bins, data):
+    """
+    Replaces the raw numeric values of the data with the labels of their bins, found by binary
+    search on the edges. Intervals are open on the left and closed on the right, as in cut.
+    Values that are not numbers (for example, labels already binned) are kept.
+
+    Args:
+        bins (dict): Discretizer returned by load_discretizer, from_labels or from_model.
+        data (DataFrame): Applications, one per row.
+
+    Returns:
+        DataFrame: A copy of the data with the numeric attributes binned.
+
+    Raises:
+        ValueError: If a value is below the first edge or above the last one. apply_discretizer
+            in R gives them no bin either (NA), so they are rejected instead of scored.
+    """
+    data = data.copy()
+    for column, (edges, labels) in bins.items():
+        if column not in data:
+            continue
+        values = pd.to_numeric(data[column], errors='coerce').to_numpy(dtype=np.float64)
+        numeric = ~np.isnan(values)
+        bin = np.searchsorted(edges, values[numeric], side='left') - 1
+        outside = (bin < 0) | (bin >= len(labels))
+        if np.any(outside):
+            raise ValueError("%s is out of the range of the discretizer (%g, %g]: %s"
+                             % (column, edges[0], edges[-1], ", ".join("%g" % v for v in values[numeric][outside])))
+        binned = np.array(data[column], dtype=object)
+        binned[numeric] = labels[bin]
+        data[column] = binned
+    return data
@@ -1,7 +1,11 @@
 from pydantic import BaseModel
+import asyncio
+import os
+import re
+import time
 import pandas as pd
 from fastapi import FastAPI, Request, Form, Response
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.templating  import Jinja2Templates
 
 app = FastAPI()
@@ -19,8 +23,212 @@ async def application_form(request: Request):
 
 
 
-from pyCBA import predict_model, init_model
-transactions, rules, weights = init_model("../data/Statlog_rCBA.csv", 0.7,0.01, 0.01)
+from pool import InferencePool, predict, predict_many
+from admission import Rejected, RateLimiter, client_key, deadline
+from audit import AuditLog
+from cache import DecisionCache
+from metrics import Metrics
+from profiler import start_profiler
+from shadow import ShadowScorer
+import discretizer
+import npCBA
+import npXGB
+
+# Counters and latency histograms of the requests and of every stage of the predictions
+metrics = Metrics()
+
+# Optional sampling profiler of the API and worker processes, one collapsed stack file per process
+profile_dir = os.environ.get("XAI_PROFILE")
+
+# Optional pruning of the rules before they are deployed
+prune = {}
+if os.environ.get("XAI_PRUNE"):
+    prune["method"] = os.environ["XAI_PRUNE"].split(",")
+if os.environ.get("XAI_MAX_RULES"):
+    prune["max_rules"] = int(os.environ["XAI_MAX_RULES"])
+
+# The model is exported once and every worker process memory-maps the same copy
+pool = InferencePool(("../data/Statlog_rCBA.csv", 0.7, 0.01, 0.01, prune or None),
+                     workers=int(os.environ.get("XAI_WORKERS", os.cpu_count())),
+                     queue_size=int(os.environ.get("XAI_QUEUE_SIZE", 64)),
+                     health_timeout=float(os.environ.get("XAI_HEALTH_TIMEOUT", 60)),
+                     model_dir=os.environ.get("XAI_MODEL_DIR", "models"),
+                     discretizer_path=os.environ.get("XAI_DISCRETIZER", "../data/discretizer.json"),
+                     metrics=metrics,
+                     profile_dir=profile_dir,
+                     max_in_flight=int(os.environ.get("XAI_MAX_IN_FLIGHT", 0)) or None)
+
+# Admission control of the routes that reach the model: rate limit per client and maximum
+# seconds a request waits for a free worker
+ADMITTED_ROUTES = ("/sendApplication", "/sendApplications")
+rate_limiter = RateLimiter(float(os.environ.get("XAI_RATE_LIMIT", 0)), int(os.environ.get("XAI_RATE_BURST", 20)))
+client_header = os.environ.get("XAI_CLIENT_HEADER")
+request_timeout = float(os.environ.get("XAI_REQUEST_TIMEOUT", 30))
+
+# Optional shadow scoring of every decision with the XGBoost model, to track the agreement of both models
+shadow_model = os.environ.get("XAI_SHADOW_MODEL", "../data/xgboost.json")
+
+# Single writer of the audit log, fed by all the worker processes and the cache
+audit = AuditLog(metrics, batch_size=int(os.environ.get("XAI_LOG_BATCH", 256)),
+                 max_pending=int(os.environ.get("XAI_LOG_QUEUE", 4096)))
+
+# Decisions of the profiles already scored by the current model version
+cache = DecisionCache(int(os.environ.get("XAI_CACHE_SIZE", 10000)))
+
+
+def rejection_response(request, error):
+    """
+    Builds the fast response of a rejected request.
+
+    Args:
+        request (Request): The rejected request.
+        error (Rejected): Why it was rejected.
+
+    Returns:
+        JSONResponse: Response with the status code of the rejection and the Retry-After header.
+    """
+    metrics.inc("xai_rejected_total", path=request.url.path, reason=error.reason)
+    return JSONResponse(status_code=error.status, headers={"Retry-After": str(error.retry_after)},
+                        content={"detail": "The request was rejected (%s), retry later." % error.reason})
+
+
+@app.exception_handler(Rejected)
+async def rejected(request: Request, error: Rejected):
+    return rejection_response(request, error)
+
+
+@app.middleware("http")
+async def admit_requests(request: Request, call_next):
+    # Requests to the model are rate limited by client and given a deadline before reaching the pool
+    if request.url.path in ADMITTED_ROUTES:
+        try:
+            rate_limiter.check(client_key(request, client_header))
+        except Rejected as error:
+            return rejection_response(request, error)
+        request.state.deadline = deadline(request, request_timeout)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def count_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # The template of the route keeps the number of label values bounded
+    route = request.scope.get("route")
+    path = route.path if route is not None else "other"
+    metrics.inc("xai_requests_total", path=path, method=request.method, status=response.status_code)
+    metrics.observe("xai_request_duration_seconds", time.perf_counter() - start, path=path)
+    return response
+
+
+@app.on_event("startup")
+async def start_pool():
+    app.state.profiler = start_profiler(profile_dir)
+    pool.start()
+    audit.start()
+    # Same read-only copy of the model as the workers, used to explain their decisions
+    app.state.model = npCBA.load_model(pool.model_path)
+    # The workers always attach to this model, its version is known without asking them
+    app.state.version = str(app.state.model['version'])
+    # Bins of the numeric attributes, used to score raw numeric values
+    app.state.bins = discretizer.from_model(app.state.model)
+    app.state.shadow = None
+    if os.path.exists(shadow_model):
+        encoder = npXGB.fit_encoder(os.environ.get("XAI_SHADOW_LABELS", "../data/Statlog_weights.csv"),
+                                    os.environ.get("XAI_SHADOW_CODES", "../data/Statlog_XGB.csv"), app.state.bins)
+        app.state.shadow = ShadowScorer(npXGB.load_model(shadow_model), encoder, metrics,
+                                        batch_size=int(os.environ.get("XAI_SHADOW_BATCH", 256)),
+                                        interval=float(os.environ.get("XAI_SHADOW_INTERVAL", 1)),
+                                        max_queue=int(os.environ.get("XAI_SHADOW_QUEUE", 10000)))
+        app.state.shadow_task = asyncio.create_task(app.state.shadow.run())
+    app.state.monitor = asyncio.create_task(pool.monitor(float(os.environ.get("XAI_HEALTH_INTERVAL", 30))))
+
+
+@app.on_event("shutdown")
+async def stop_pool():
+    app.state.monitor.cancel()
+    if app.state.shadow is not None:
+        app.state.shadow_task.cancel()
+        app.state.shadow.stop()
+    pool.stop()
+    # The queued predictions are written before the logger process stops
+    await audit.stop()
+    if app.state.profiler is not None:
+        app.state.profiler.stop()
+
+
+@app.get("/health")
+async def health():
+    healthy = await pool.check()
+    shadow = app.state.shadow.stats() if app.state.shadow is not None else None
+    return JSONResponse(status_code=200 if healthy else 503,
+                        content={"healthy": healthy, **pool.status(), "cache": cache.stats(), "log": audit.stats(),
+                                 "shadow": shadow})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Exposes the counters and latency histograms in the Prometheus text format.
+    """
+    status = pool.status()
+    stats = cache.stats()
+    gauges = {"xai_pool_workers": status["workers"], "xai_pool_max_in_flight": status["max_in_flight"],
+              "xai_pool_in_flight": status["in_flight"], "xai_pool_waiting": status["waiting"],
+              "xai_pool_queue_size": status["queue_size"], "xai_pool_restarts_total": status["restarts"],
+              "xai_cache_size": stats["size"], "xai_cache_hits_total": stats["hits"],
+              "xai_cache_misses_total": stats["misses"]}
+    if app.state.shadow is not None:
+        gauges.update({"xai_shadow_queued": app.state.shadow.queued, "xai_shadow_dropped_total": app.state.shadow.dropped})
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+def catalog_response(request, version, cache_control):
+    """
+    Builds the response with the rule catalog of a model version, or a 304 response if the
+    client already has it. The catalog of a version never changes, so its ETag is the version.
+
+    Args:
+        request (Request): The request, with the If-None-Match header of the client if any.
+        version (str): Version of the model.
+        cache_control (str): Value of the Cache-Control header.
+
+    Returns:
+        Response: The catalog as JSON, 304 if it did not change or 404 if the version is unknown.
+    """
+    etag = '"%s"' % version
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    path = os.path.join(pool.model_dir, "engine_" + version)
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", version) or not os.path.isdir(path):
+        return JSONResponse(status_code=404, content={"detail": "Unknown model version."})
+    if os.path.exists(os.path.join(path, npCBA.CATALOG_FILE)):
+        with open(os.path.join(path, npCBA.CATALOG_FILE), "rb") as f:
+            content = f.read()
+    else:
+        # Models exported before the catalog was saved with them
+        content = JSONResponse(content=npCBA.catalog(npCBA.load_model(path))).body
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+@app.get("/rules")
+async def rules(request: Request):
+    """
+    Returns the rule catalog of the loaded model, which resolves the rule IDs of the compact
+    explanations. Clients revalidate it with the ETag, it only changes with the model version.
+    """
+    return catalog_response(request, app.state.version, "no-cache")
+
+
+@app.get("/rules/{version}")
+async def rules_version(request: Request, version: str):
+    """
+    Returns the rule catalog of a model version, which resolves the rule IDs of the audit log.
+    """
+    return catalog_response(request, version, "public, max-age=31536000, immutable")
+
 
 @app.post("/sendApplication")
 async def send_application(
@@ -46,39 +254,164 @@ async def send_application(
     telephone: str = Form(...),
     foreign_worker: str = Form(...),
     gender: str = Form(...),
-    marital_status: str = Form(...)
+    marital_status: str = Form(...),
+    raw: bool = False,
+    compact: bool = False
 ):
 
-    df = pd.DataFrame({
-        'Status.of.existing.checking.account': [status],
-        'Duration.in.month': [duration],
-        'Credit.history': [credit_history],
-        'Purpose': [purpose],
-        'Credit.amount': [credit_amount],
-        'Savings.account.bonds': [savings],
-        'Present.employment.since': [employment_since],
-        'Installment.rate.in.percentage.of.disposable.income': [installment_rate],
-        'Other.debtors...guarantors': [debtors],
-        'Present.residence.since': [residence_since],
-        'Property': [property],
-        'Age.in.years': [age],
-        'Other.installment.plans': [other_plans],
-        'Housing': [housing],
-        'Number.of.existing.credits.at.this.bank': [existing_credits],
-        'Job': [job],
-        'Number.of.people.being.liable.to.provide.maintenance.for': [maintenance_people],
-        'Telephone': [telephone],
-        'Foreign.worker': [foreign_worker],
-        'Gender': [gender],
-        'Marital.Status': [marital_status]
-    })
+    with metrics.span("dataframe"):
+        df = pd.DataFrame({
+            'Status.of.existing.checking.account': [status],
+            'Duration.in.month': [duration],
+            'Credit.history': [credit_history],
+            'Purpose': [purpose],
+            'Credit.amount': [credit_amount],
+            'Savings.account.bonds': [savings],
+            'Present.employment.since': [employment_since],
+            'Installment.rate.in.percentage.of.disposable.income': [installment_rate],
+            'Other.debtors...guarantors': [debtors],
+            'Present.residence.since': [residence_since],
+            'Property': [property],
+            'Age.in.years': [age],
+            'Other.installment.plans': [other_plans],
+            'Housing': [housing],
+            'Number.of.existing.credits.at.this.bank': [existing_credits],
+            'Job': [job],
+            'Number.of.people.being.liable.to.provide.maintenance.for': [maintenance_people],
+            'Telephone': [telephone],
+            'Foreign.worker': [foreign_worker],
+            'Gender': [gender],
+            'Marital.Status': [marital_status]
+        })
     
-    prediction, r = predict_model(transactions, rules, weights, df, True)
-    print("Prediction:", prediction)
-    print("Rules:", r)
+    # The shadow model scores the application as received, with the raw numeric values if any
+    received = df
 
-    # pandas dataframe to json as csv
-    r = r.to_dict('records')
+    # Raw numeric values are binned with the discretizer of the model
+    if raw:
+        with metrics.span("discretize"):
+            try:
+                df = discretizer.discretize(app.state.bins, df)
+            except ValueError as error:
+                return JSONResponse(status_code=400, content={"detail": str(error)})
 
+    # Identical profiles get identical decisions from the same model version. A cached decision
+    # is returned without waiting for a worker, once it is written to the audit log
+    version = app.state.version
+    with metrics.span("cache"):
+        key = cache.key(df)
+        decision = cache.get(version, key)
+    if decision is None:
+        # The worker returns the indices of the rules, they are explained here
+        decision = await pool.run(predict, df, True, deadline=request.state.deadline,
+                                  disconnected=request.is_disconnected)
+        cache.put(version, key, decision)
+        source = "model"
+    else:
+        source = "cache"
+    prediction, rule_ids = decision
+    metrics.inc("xai_decisions_total", decision=prediction, source=source)
+    # Decisions of the model and of the cache are written to the audit log by its single writer,
+    # and only returned once they are durable
+    await audit.submit(df, [prediction], [npCBA.rule_keys(app.state.model, rule_ids)], version,
+                       deadline=request.state.deadline)
+    if app.state.shadow is not None:
+        app.state.shadow.submit(received, [prediction], version)
+
+    # The compact explanation only has the IDs of the rules, resolved with the catalog of /rules
+    with metrics.span("explain"):
+        if compact:
+            r = npCBA.contributions(app.state.model, rule_ids)
+        else:
+            r = npCBA.explain(app.state.model, rule_ids)
+
+    if compact:
+        return {"Prediction": prediction, "Version": version, "Rules": r}
     return {"Prediction": prediction, "Rules": r}
- 
\ No newline at end of file
+ 
+
+
+def column_errors(df):
+    """
+    Checks that a batch of applications has exactly the attributes of the model. The model
+    ignores unknown columns and treats missing ones as absent values, so a misspelled column
+    would silently get a decision of the default class.
+
+    Args:
+        df (DataFrame): Applications of the batch.
+
+    Returns:
+        JSONResponse: A 400 response with the missing and unknown columns, or None if they match.
+    """
+    expected = npCBA.attributes(app.state.model)
+    missing = [column for column in expected if column not in df.columns]
+    unknown = [str(column) for column in df.columns if column not in expected]
+    if not missing and not unknown:
+        return None
+    return JSONResponse(status_code=400, content={"detail": "The columns do not match the attributes of the model.",
+                                                  "missing": missing, "unknown": unknown})
+
+
+@app.post("/sendApplications")
+async def send_applications(request: Request, raw: bool = False, compact: bool = False):
+    """
+    Scores many applications in a single call to the model. The applications can be
+    sent as a CSV file in the "file" field of a multipart form or as a JSON list of
+    objects, using the column names of the training data. With the raw query parameter,
+    the numeric attributes can be sent as numbers instead of bin labels. With the compact
+    query parameter, the rules are returned as their stable IDs and votes instead of their
+    indices (starting at 1). The batch is rejected with a 400 response if its columns are not
+    exactly the attributes of the model, if the body cannot be read or if a raw numeric value is
+    outside the bins of the discretizer.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        file = form.get("file")
+        if not hasattr(file, "file"):
+            return JSONResponse(status_code=400, content={"detail": "The CSV file must be sent in the \"file\" field."})
+        try:
+            df = pd.read_csv(file.file, dtype=str)
+        except (ValueError, UnicodeDecodeError) as error:
+            return JSONResponse(status_code=400, content={"detail": "The CSV file could not be read: %s" % error})
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            return JSONResponse(status_code=400, content={"detail": "The body is not valid JSON."})
+        if not isinstance(body, list) or not all(isinstance(row, dict) for row in body):
+            return JSONResponse(status_code=400, content={"detail": "The body must be a JSON list of objects."})
+        df = pd.DataFrame(body, dtype=str)
+
+    if df.empty:
+        return JSONResponse(status_code=400, content={"detail": "No applications were sent."})
+    error = column_errors(df)
+    if error is not None:
+        return error
+
+    received = df
+    if raw:
+        try:
+            df = discretizer.discretize(app.state.bins, df)
+        except ValueError as error:
+            return JSONResponse(status_code=400, content={"detail": str(error)})
+
+    # Split the batch among the workers. The batch is admitted as a whole, and it is only logged
+    # once every chunk has been predicted
+    size = max(1, -(-len(df) // pool.workers))
+    chunks = await pool.run_many(predict_many, [(df.iloc[i:i + size], True) for i in range(0, len(df), size)],
+                                 deadline=request.state.deadline, disconnected=request.is_disconnected)
+    predictions = [p for chunk in chunks for p in chunk[0]]
+    rules = [r for chunk in chunks for r in chunk[1]]
+    for p in predictions:
+        metrics.inc("xai_decisions_total", decision=p, source="model")
+    version = app.state.version
+    await audit.submit(df, predictions, [npCBA.rule_keys(app.state.model, r) for r in rules], version,
+                       deadline=request.state.deadline)
+    if app.state.shadow is not None:
+        app.state.shadow.submit(received, predictions, version)
+
+    if compact:
+        return {"Version": version,
+                "Predictions": [{"Prediction": p, "Rules": npCBA.contributions(app.state.model, r)}
+                                for p, r in zip(predictions, rules)]}
+    return {"Predictions": [{"Prediction": p, "Rules": [i + 1 for i in r]} for p, r in zip(predictions, rules)]}
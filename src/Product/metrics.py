@@ -0,0 +1,170 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of every metric exposed on /metrics
+METRICS = {
+    "xai_requests_total": ("counter", "Requests answered by the API, by route and status code."),
+    "xai_request_duration_seconds": ("histogram", "Latency of the requests, by route."),
+    "xai_stage_duration_seconds": ("histogram", "Latency of every stage of the predictions, by stage."),
+    "xai_decisions_total": ("counter", "Decisions returned, by decision and source (model or cache)."),
+    "xai_pool_workers": ("gauge", "Worker processes of the inference pool."),
+    "xai_pool_in_flight": ("gauge", "Tasks handed to the workers of the inference pool."),
+    "xai_pool_max_in_flight": ("gauge", "Tasks that can be handed to the workers at once."),
+    "xai_pool_waiting": ("gauge", "Tasks waiting for a free slot of the inference pool."),
+    "xai_pool_queue_size": ("gauge", "Tasks that can wait for a free slot of the inference pool."),
+    "xai_rejected_total": ("counter", "Requests rejected before reaching the model, by route and reason."),
+    "xai_pool_restarts_total": ("counter", "Restarts of the worker processes."),
+    "xai_cache_size": ("gauge", "Profiles kept in the decision cache."),
+    "xai_cache_hits_total": ("counter", "Hits of the decision cache."),
+    "xai_cache_misses_total": ("counter", "Misses of the decision cache."),
+    "xai_log_failed_total": ("counter", "Predictions that could be neither written to the audit log nor spilled to disk."),
+    "xai_log_spilled_total": ("counter", "Predictions spilled to disk because the audit log could not be written."),
+    "xai_shadow_total": ("counter", "Applications scored again by the XGBoost model, by result (agree or disagree) and input."),
+    "xai_shadow_segment_total": ("counter", "Applications scored again by the XGBoost model, by segment, result and input."),
+    "xai_shadow_queued": ("gauge", "Applications waiting to be scored by the XGBoost model."),
+    "xai_shadow_failed_total": ("counter", "Applications not scored by the XGBoost model because of an error."),
+    "xai_shadow_dropped_total": ("counter", "Applications not scored by the XGBoost model because its queue was full."),
+}
+
+
+@contextmanager
+def span(spans, stage):
+    """
+    Times a block of code as a stage of a request.
+
+    Args:
+        spans (list): List where the stage and its duration in seconds are appended.
+        stage (str): Name of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((stage, time.perf_counter() - start))
+
+
+def escape(value):
+    """
+    Args:
+        value: Value of a label.
+
+    Returns:
+        str: The value escaped for the Prometheus text format.
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    """
+    Args:
+        labels (tuple): Pairs of label name and value.
+
+    Returns:
+        str: The labels in the Prometheus text format, empty if there are none.
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, escape(value)) for name, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the API, rendered in the Prometheus text format.
+    Every update takes constant time, the samples themselves are not kept.
+
+    Args:
+        buckets (tuple, optional): Upper bounds of the buckets of the histograms, in seconds (default is BUCKETS).
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Args:
+            name (str): Name of the counter.
+            value (float, optional): Increment (default is 1).
+            **labels: Labels of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Args:
+            name (str): Name of the histogram.
+            seconds (float): Observed latency.
+            **labels: Labels of the histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # Count of every bucket, the last one is +Inf, followed by the sum of the latencies
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def observe_spans(self, spans, prefix=""):
+        """
+        Adds the spans of a request to the histogram of the stages.
+
+        Args:
+            spans (list): Pairs of stage and duration in seconds.
+            prefix (str, optional): Prefix added to the name of every stage (default is "").
+        """
+        for stage, seconds in spans:
+            self.observe("xai_stage_duration_seconds", seconds, stage=prefix + stage)
+
+    @contextmanager
+    def span(self, stage):
+        """
+        Times a block of code of the API process as a stage of a request.
+
+        Args:
+            stage (str): Name of the stage.
+        """
+        spans = []
+        with span(spans, stage):
+            yield
+        self.observe_spans(spans)
+
+    def render(self, gauges=None):
+        """
+        Args:
+            gauges (dict, optional): Current value of the gauges and of the counters kept elsewhere,
+                by metric name (default is None).
+
+        Returns:
+            str: All the metrics in the Prometheus text format.
+        """
+        samples = {name: [] for name in METRICS}
+        for name, value in (gauges or {}).items():
+            samples.setdefault(name, []).append("%s %s" % (name, value))
+        for (name, labels), value in sorted(self.counters.items()):
+            samples.setdefault(name, []).append("%s%s %s" % (name, format_labels(labels), value))
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            lines = samples.setdefault(name, [])
+            for bound, count in zip(self.buckets + ("+Inf",), histogram[:-1]):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", bound),)), cumulative))
+            lines.append("%s_sum%s %s" % (name, format_labels(labels), histogram[-1]))
+            lines.append("%s_count%s %d" % (name, format_labels(labels), cumulative))
+
+        text = []
+        for name, lines in samples.items():
+            if not lines:
+                continue
+            if name in METRICS:
+                kind, description = METRICS[name]
+                text.append("# HELP %s %s" % (name, description))
+                text.append("# TYPE %s %s" % (name, kind))
+            text.extend(lines)
+        return "\n".join(text) + "\n"
@@ -0,0 +1,451 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+CLASS_PREFIX = "Class="
+
+# Arrays that make up a saved model
+MODEL_ARRAYS = ['item_labels', 'lhs', 'rule_class', 'classes', 'support',
+                'confidence', 'weights', 'default', 'method', 'version', 'table_columns', 'rule_ids']
+
+# Scalar arrays of a saved model, never memory-mapped
+SCALAR_ARRAYS = ['default', 'method', 'version']
+
+# Prefix of the columns of the rule table in a saved model
+TABLE_PREFIX = "table."
+
+# Prefix of the arrays of the discretizer in a saved model (see discretizer.py)
+BINS_PREFIX = "bins."
+
+# Maximum number of (applicant, rule, word) cells evaluated at once
+CHUNK_CELLS = 4_000_000
+
+# File of the rule catalog saved next to the arrays of a model directory
+CATALOG_FILE = "rules.json"
+
+# Layout of the saved model directories, increased whenever save_model or build_model change
+# what is exported, so that the directories written by an older version are exported again
+FORMAT_VERSION = 1
+
+# File with the format version of a model directory
+FORMAT_FILE = "format"
+
+
+def rule_id(items, rhs):
+    """
+    Computes the stable ID of a rule from its content, so that the same rule gets the same ID
+    in every model version, whatever its position in the classifier.
+
+    Args:
+        items (list): Labels ("attribute=value") of the LHS items of the rule, in any order.
+        rhs (str): RHS label ("Class=value") of the rule.
+
+    Returns:
+        str: The ID of the rule, 16 hexadecimal characters.
+    """
+    return hashlib.sha1((",".join(sorted(items)) + "=>" + rhs).encode("utf-8")).hexdigest()[:16]
+
+
+def rule_items(model):
+    """
+    Decodes the LHS of every rule of a model.
+
+    Args:
+        model (dict): Model returned by build_model or load_model.
+
+    Returns:
+        list: Labels of the LHS items of every rule.
+    """
+    lhs = np.asarray(model['lhs'])
+    rules, words, bits = np.nonzero((lhs[:, :, np.newaxis] >> np.arange(64, dtype=np.uint64)) & np.uint64(1))
+    items = [[] for _ in range(len(lhs))]
+    for r, label in zip(rules, model['item_labels'][words * 64 + bits]):
+        items[r].append(str(label))
+    return items
+
+
+def build_model(item_labels, rule, item, rhs, support, confidence, weights, default, method, version="", table=None):
+    """
+    Builds the array-backed form of a CBA classifier from its exported rules.
+
+    Args:
+        item_labels (list): Labels ("attribute=value") of every item known by the rules.
+        rule (list): Index (starting at 1) of the rule of every LHS item.
+        item (list): Label of every LHS item, aligned with rule.
+        rhs (list): RHS label ("Class=value") of every rule.
+        support (list): Support of every rule.
+        confidence (list): Confidence of every rule.
+        weights (list): Weight of every rule in the vote.
+        default (str): Default class used when no rule matches.
+        method (str): Voting method of the classifier ("majority" or "weighted").
+        version (str, optional): Version of the classifier the rules come from (default is "").
+        table (DataFrame, optional): Rule table used to explain the predictions, one row per rule (default is None).
+
+    Returns:
+        dict: The model, with the LHS of every rule encoded as a bitset over the items.
+    """
+    item_labels = np.asarray(item_labels, dtype=str)
+    n_rules = len(rhs)
+    n_words = max(1, (len(item_labels) + 63) // 64)
+
+    # Class levels, in the same order as the items of the rules
+    classes = np.array([label[len(CLASS_PREFIX):] for label in item_labels if label.startswith(CLASS_PREFIX)])
+    class_index = {label: i for i, label in enumerate(classes)}
+
+    # Encode the LHS of every rule as a bitset
+    item_index = {label: i for i, label in enumerate(item_labels)}
+    lhs = np.zeros((n_rules, n_words), dtype=np.uint64)
+    rule = np.asarray(rule, dtype=np.int64) - 1
+    bit = np.array([item_index[label] for label in item], dtype=np.int64)
+    np.bitwise_or.at(lhs, (rule, bit // 64), np.left_shift(np.uint64(1), (bit % 64).astype(np.uint64)))
+
+    # Stable ID of every rule, from its LHS items and its class
+    lhs_items = [[] for _ in range(n_rules)]
+    for r, label in zip(rule, item):
+        lhs_items[r].append(label)
+
+    model = {
+        'item_labels': item_labels,
+        'lhs': lhs,
+        'rule_class': np.array([class_index[label[len(CLASS_PREFIX):]] for label in rhs], dtype=np.int64),
+        'classes': classes,
+        'support': np.asarray(support, dtype=np.float64),
+        'confidence': np.asarray(confidence, dtype=np.float64),
+        'weights': np.asarray(weights, dtype=np.float64),
+        'default': np.array(default, dtype=str),
+        'method': np.array(method, dtype=str),
+        'version': np.array(version, dtype=str),
+        'rule_ids': np.array([rule_id(items, label) for items, label in zip(lhs_items, rhs)], dtype=str),
+    }
+
+    # Columns of the rule table as plain arrays, missing values as empty strings
+    if table is not None:
+        model['table_columns'] = np.asarray(table.columns, dtype=str)
+        for column in table.columns:
+            values = table[column]
+            if pd.api.types.is_numeric_dtype(values):
+                model[TABLE_PREFIX + column] = values.to_numpy(dtype=np.float64)
+            else:
+                model[TABLE_PREFIX + column] = values.fillna("").astype(str).to_numpy(dtype=str)
+
+    return model
+
+
+def save_model(model, path):
+    """
+    Saves the arrays of a model. A path ending in .npz is written as a compressed NumPy
+    file, any other path as a directory with one uncompressed .npy file per array, which
+    can be memory-mapped by load_model, and the rule catalog (see catalog) as JSON.
+
+    Args:
+        model (dict): Model returned by build_model or load_model.
+        path (str): File path of the .npz file or of the directory.
+    """
+    arrays = {key: model[key] for key in model
+              if key in MODEL_ARRAYS or key.startswith(TABLE_PREFIX) or key.startswith(BINS_PREFIX)}
+
+    if path.endswith(".npz"):
+        np.savez_compressed(path, **arrays)
+        return
+
+    # Write the directory aside and publish it with a rename, readers never see a partial model
+    tmp = "%s.tmp%d" % (path, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for key, value in arrays.items():
+        np.save(os.path.join(tmp, key + ".npy"), value, allow_pickle=False)
+    # The full text of the rules is kept once per model version, predictions only refer to their IDs
+    with open(os.path.join(tmp, CATALOG_FILE), "w", encoding="utf-8") as f:
+        json.dump(catalog(model), f)
+    with open(os.path.join(tmp, FORMAT_FILE), "w", encoding="utf-8") as f:
+        f.write(str(FORMAT_VERSION))
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        if saved_format(path) == FORMAT_VERSION:
+            # Another process published the same model first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        # Replace a directory of an older format, the processes that mapped its arrays keep reading them
+        old = "%s.old%d" % (path, os.getpid())
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def saved_format(path):
+    """
+    Args:
+        path (str): Path of a model directory written by save_model.
+
+    Returns:
+        int: Format version of the directory, 0 if it was written before the format was recorded
+            and None if the directory does not exist.
+    """
+    if not os.path.isdir(path):
+        return None
+    try:
+        with open(os.path.join(path, FORMAT_FILE), encoding="utf-8") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def load_model(path, mmap=True):
+    """
+    Loads a model saved with save_model and prepares it for predictions.
+
+    The arrays of a model saved as a directory are memory-mapped read-only, so every
+    process that loads the same directory shares a single copy of them in the page cache.
+
+    Args:
+        path (str): File path of the .npz file or of the directory.
+        mmap (bool, optional): Whether to memory-map the arrays of a directory (default is True).
+
+    Returns:
+        dict: The model, ready to be used by predict_model.
+    """
+    if os.path.isdir(path):
+        model = {}
+        for name in os.listdir(path):
+            if name.endswith(".npy"):
+                key = name[:-len(".npy")]
+                model[key] = np.load(os.path.join(path, name), mmap_mode="r" if mmap and key not in SCALAR_ARRAYS else None,
+                                     allow_pickle=False)
+    else:
+        with np.load(path, allow_pickle=False) as data:
+            model = {key: data[key] for key in data.files}
+
+    return prepare_model(model)
+
+
+def prepare_model(model):
+    """
+    Adds to a model the lookup tables used to encode applicants and to count votes.
+
+    Args:
+        model (dict): Model returned by build_model.
+
+    Returns:
+        dict: The same model with its lookup tables.
+    """
+    # Models exported before the rules had stable IDs
+    if 'rule_ids' not in model:
+        rhs = [CLASS_PREFIX + label for label in model['classes'][model['rule_class']]]
+        model['rule_ids'] = np.array([rule_id(items, label) for items, label in zip(rule_items(model), rhs)], dtype=str)
+    # Item index of every value, grouped by attribute
+    lookup = {}
+    for i, label in enumerate(model['item_labels']):
+        attribute, value = label.split("=", 1)
+        values, items = lookup.setdefault(attribute, ([], []))
+        values.append(value)
+        items.append(i)
+    model['lookup'] = {attribute: (pd.Index(values), np.array(items, dtype=np.int64))
+                       for attribute, (values, items) in lookup.items()}
+
+    # Vote of every rule for its class
+    votes = np.zeros((len(model['rule_class']), len(model['classes'])))
+    weights = model['weights'] if str(model['method']) == "weighted" else 1.0
+    votes[np.arange(len(model['rule_class'])), model['rule_class']] = weights
+    model['votes'] = votes
+    model['default_index'] = int(np.flatnonzero(model['classes'] == str(model['default']))[0])
+
+    return model
+
+
+def attributes(model):
+    """
+    Args:
+        model (dict): Model returned by load_model.
+
+    Returns:
+        list: Names of the attributes of the applicants, the columns of the training data without the class.
+    """
+    return [attribute for attribute in model['lookup'] if attribute != CLASS_PREFIX[:-1]]
+
+
+def encode(model, to_predict):
+    """
+    Encodes applicants as bitsets over the items of the model.
+
+    Args:
+        model (dict): Model returned by load_model.
+        to_predict (DataFrame): Applicants, one per row, with the same columns as the training data.
+
+    Returns:
+        ndarray: One bitset per applicant. Values unknown to the model set no bit.
+    """
+    bits = np.zeros((len(to_predict), model['lhs'].shape[1]), dtype=np.uint64)
+
+    for attribute, (values, items) in model['lookup'].items():
+        if attribute not in to_predict:
+            continue
+        codes = values.get_indexer(to_predict[attribute].astype(str))
+        rows = np.flatnonzero(codes >= 0)
+        bit = items[codes[rows]]
+        np.bitwise_or.at(bits, (rows, bit // 64), np.left_shift(np.uint64(1), (bit % 64).astype(np.uint64)))
+
+    return bits
+
+
+def match_rules(model, bits):
+    """
+    Finds the rules whose LHS is contained in every applicant.
+
+    Args:
+        model (dict): Model returned by load_model.
+        bits (ndarray): Bitsets returned by encode.
+
+    Returns:
+        ndarray: Boolean matrix with one row per applicant and one column per rule.
+    """
+    lhs = model['lhs']
+    matches = np.empty((len(bits), len(lhs)), dtype=bool)
+    step = max(1, CHUNK_CELLS // max(1, lhs.size))
+
+    for start in range(0, len(bits), step):
+        chunk = bits[start:start + step]
+        # A rule matches if none of its items is missing from the applicant
+        missing = lhs[np.newaxis, :, :] & ~chunk[:, np.newaxis, :]
+        matches[start:start + step] = ~missing.any(axis=2)
+
+    return matches
+
+
+def predict_model(model, to_predict, get_rules=False):
+    """
+    Makes predictions with the exported rules, voting over all matching rules.
+
+    Args:
+        model (dict): Model returned by load_model.
+        to_predict (DataFrame): New data to make predictions on.
+        get_rules (bool, optional): Whether to return the index of the rules used for every prediction (default is False).
+
+    Returns:
+        tuple: A tuple containing the predicted class of every row and optionally the rules used for every prediction.
+    """
+    matches = match_rules(model, encode(model, to_predict))
+
+    # Majority (or weighted) vote, ties go to the first class level
+    scores = matches @ model['votes']
+    best = np.where(matches.any(axis=1), scores.argmax(axis=1), model['default_index'])
+    prediction = model['classes'][best]
+
+    rules = [np.flatnonzero(row) for row in matches] if get_rules else None
+
+    return prediction, rules
+
+
+def explain(model, rule_ids):
+    """
+    Gets the rows of the rule table of some rules.
+
+    Args:
+        model (dict): Model returned by load_model, exported with its rule table.
+        rule_ids (list): Indices (starting at 0) of the rules, as returned by predict_model.
+
+    Returns:
+        list: One record per rule, with None for the attributes that are not in its LHS.
+    """
+    columns = {column: model[TABLE_PREFIX + column] for column in table_columns(model)}
+    records = []
+    for i in rule_ids:
+        record = {}
+        for column, values in columns.items():
+            value = values[i].item()
+            record[column] = None if value == "" else value
+        records.append(record)
+
+    return records
+
+
+def rule_keys(model, rule_ids):
+    """
+    Args:
+        model (dict): Model returned by load_model.
+        rule_ids (list): Indices (starting at 0) of some rules, as returned by predict_model.
+
+    Returns:
+        list: Stable IDs of the rules.
+    """
+    return [str(model['rule_ids'][i]) for i in rule_ids]
+
+
+def contributions(model, rule_ids):
+    """
+    Gets the compact explanation of a prediction: the rules used and their vote.
+
+    Args:
+        model (dict): Model returned by load_model.
+        rule_ids (list): Indices (starting at 0) of the rules used for the prediction, as returned by predict_model.
+
+    Returns:
+        list: One record per rule, with its stable ID, the class it votes for and the weight of its vote.
+    """
+    return [{"id": str(model['rule_ids'][i]),
+             "class": str(model['classes'][model['rule_class'][i]]),
+             "vote": float(model['votes'][i, model['rule_class'][i]])} for i in rule_ids]
+
+
+def catalog(model):
+    """
+    Builds the catalog of the rules of a model, used to resolve the IDs of the compact explanations
+    and of the audit log.
+
+    Args:
+        model (dict): Model returned by build_model or load_model.
+
+    Returns:
+        dict: The version of the model and one record per rule, in the order of the classifier, with its
+        stable ID, its LHS as attribute-value pairs, its class, its vote weight and its quality measures.
+    """
+    # Quality measures of the rule table (support, confidence, lift, count...)
+    measures = [column for column in table_columns(model) if np.asarray(model[TABLE_PREFIX + column]).dtype.kind == "f"]
+    rules = []
+    for i, items in enumerate(rule_items(model)):
+        rule = {"id": str(model['rule_ids'][i]),
+                "lhs": dict(item.split("=", 1) for item in items),
+                "class": str(model['classes'][model['rule_class'][i]]),
+                "weight": float(model['weights'][i]),
+                "support": float(model['support'][i]),
+                "confidence": float(model['confidence'][i])}
+        for column in measures:
+            rule.setdefault(column, float(model[TABLE_PREFIX + column][i]))
+        rules.append(rule)
+
+    return {"version": str(model['version']), "default": str(model['default']),
+            "method": str(model['method']), "rules": rules}
+
+
+def table_columns(model):
+    """
+    Args:
+        model (dict): Model returned by load_model.
+
+    Returns:
+        list: Names of the columns of the rule table of the model, in their original order.
+    """
+    return [str(column) for column in model['table_columns']] if 'table_columns' in model else []
+
+
+if __name__ == "__main__":
+
+    from pyCBA import init_model, export_model
+    import rpy2.robjects as robjects
+
+    # Export the model mined in R and compare both engines on the whole dataset
+    classifier = init_model("../data/Statlog_rCBA.csv", 0.7, 0.01, 0.01)
+    export_model(classifier, "model.npz")
+    model = load_model("model.npz")
+
+    data = pd.read_csv("../data/Statlog_rCBA.csv", dtype=str).drop(columns=['Class', 'Weights'])
+
+    r_predict = robjects.r('function(classifier, data) as.character(predict(classifier, as(data, "transactions")))')
+    expected = np.array([str(x) for x in r_predict(classifier, robjects.vectors.DataFrame(data))])
+    prediction, _ = predict_model(model, data)
+
+    print("Agreement with R:", np.mean(prediction == expected))
@@ -0,0 +1,192 @@
+import json
+import re
+import numpy as np
+import pandas as pd
+import discretizer
+
+
+# Columns of the data that are not features of the model
+NON_FEATURES = ['Class', 'Weights']
+
+# Objectives whose class is predicted as predict_class does in src/R/Modelos/xgboost.R: the most likely
+# class of the multi-class objectives, a probability above 0.5 for the logistic ones, and the sign of
+# the margin for the hinge loss
+OBJECTIVES = ('binary:logistic', 'reg:logistic', 'binary:hinge', 'multi:softprob', 'multi:softmax')
+
+
+def load_model(path):
+    """
+    Loads an XGBoost model saved as JSON (xgb.save with a .json path, see src/R/Modelos/xgboost.R)
+    as padded arrays, so that all its trees are evaluated at once with NumPy, without XGBoost.
+
+    Args:
+        path (str): File path of the JSON model.
+
+    Returns:
+        dict: The model, with one row per tree in the arrays of its nodes.
+
+    Raises:
+        ValueError: If the objective of the model does not predict classes (see OBJECTIVES).
+    """
+    with open(path) as f:
+        learner = json.load(f)['learner']
+    if learner['objective']['name'] not in OBJECTIVES:
+        raise ValueError("The objective %s of the XGBoost model is not supported, it must be one of %s"
+                         % (learner['objective']['name'], ", ".join(OBJECTIVES)))
+    booster = learner['gradient_booster']['model']
+    trees = booster['trees']
+    n_nodes = max(len(tree['left_children']) for tree in trees)
+
+    def padded(key, dtype, fill):
+        values = np.full((len(trees), n_nodes), fill, dtype=dtype)
+        for i, tree in enumerate(trees):
+            values[i, :len(tree[key])] = tree[key]
+        return values
+
+    left = padded('left_children', np.int32, -1)
+    right = padded('right_children', np.int32, -1)
+
+    # Depth of the deepest leaf, the number of steps needed to reach every leaf. The children
+    # of a node always come after it
+    depth = 0
+    for tree in trees:
+        node_depth = [0] * len(tree['left_children'])
+        for i, (l, r) in enumerate(zip(tree['left_children'], tree['right_children'])):
+            if l >= 0:
+                node_depth[l] = node_depth[r] = node_depth[i] + 1
+        depth = max(depth, max(node_depth))
+
+    param = learner['learner_model_param']
+    n_groups = max(1, int(param.get('num_class', '0')))
+    base_score = np.array([float(x) for x in re.findall(r"[-+0-9.eE]+", param['base_score'])], dtype=np.float64)
+
+    return {
+        'feature': padded('split_indices', np.int32, 0),
+        # Leaves keep their value in the split condition
+        'threshold': padded('split_conditions', np.float32, 0),
+        'left': left,
+        'right': right,
+        'default_left': padded('default_left', bool, False),
+        'tree_group': np.asarray(booster['tree_info'], dtype=np.int64),
+        'depth': depth,
+        'n_groups': n_groups,
+        'base_score': np.broadcast_to(base_score, (n_groups,)) if len(base_score) in (1, n_groups) else base_score[:n_groups],
+        'objective': learner['objective']['name'],
+        'feature_names': learner.get('feature_names') or [],
+    }
+
+
+def margins(model, features):
+    """
+    Evaluates all the trees of a model for a batch of rows in one pass, level by level.
+
+    Args:
+        model (dict): Model returned by load_model.
+        features (ndarray): One row per application and one column per feature, NaN for missing values.
+
+    Returns:
+        ndarray: Raw score of every row for every output group (class), before the objective function.
+    """
+    features = np.asarray(features, dtype=np.float32)
+    n_rows, n_trees = len(features), len(model['left'])
+    trees = np.arange(n_trees)
+    node = np.zeros((n_rows, n_trees), dtype=np.int32)
+
+    for _ in range(model['depth']):
+        left = model['left'][trees, node]
+        value = features[np.arange(n_rows)[:, np.newaxis], model['feature'][trees, node]]
+        go_left = np.where(np.isnan(value), model['default_left'][trees, node], value < model['threshold'][trees, node])
+        node = np.where(left < 0, node, np.where(go_left, left, model['right'][trees, node]))
+
+    leaves = model['threshold'][trees, node].astype(np.float64)
+    groups = np.zeros((n_trees, model['n_groups']))
+    groups[trees, model['tree_group']] = 1
+    return leaves @ groups + model['base_score']
+
+
+def predict(model, features):
+    """
+    Predicts the class index of every row, as XGBoost does for the objective of the model.
+
+    Args:
+        model (dict): Model returned by load_model.
+        features (ndarray): One row per application and one column per feature, NaN for missing values.
+
+    Returns:
+        tuple: The predicted class index (starting at 0) of every row and the raw scores.
+    """
+    scores = margins(model, features)
+    if model['n_groups'] > 1:
+        return scores.argmax(axis=1), scores
+    if "logistic" in model['objective']:
+        # The base score of a logistic model is a probability, and a probability above 0.5 is a positive margin
+        base = model['base_score'][0]
+        scores = scores - base + np.log(base / (1 - base))
+    return (scores[:, 0] > 0).astype(np.int64), scores
+
+
+def fit_encoder(labels_path, codes_path, bins=None):
+    """
+    Rebuilds the encoding of the training data of the XGBoost model from the same rows before and
+    after the encoding (Statlog_weights.csv and Statlog_XGB.csv), so that it matches the factor
+    codes assigned by R. The numeric attributes are not encoded; their bins are given the median
+    of the training values of the bin, so that binned applications can be scored too.
+
+    Args:
+        labels_path (str): File path of the data before the encoding.
+        codes_path (str): File path of the encoded data the model was trained on.
+        bins (dict, optional): Discretizer of the numeric attributes (default is None).
+
+    Returns:
+        dict: The feature names, the code of every level of the categorical attributes, the value
+        of every bin of the numeric attributes and the class labels.
+    """
+    codes = pd.read_csv(codes_path)
+    labels = pd.read_csv(labels_path, dtype=str)
+    labels.columns = codes.columns
+    features = [column for column in codes.columns if column not in NON_FEATURES]
+
+    levels = {}
+    bin_values = {}
+    for column in features:
+        raw = pd.to_numeric(labels[column], errors="coerce")
+        if raw.notna().all():
+            if bins and column in bins:
+                binned = discretizer.discretize({column: bins[column]}, pd.DataFrame({column: raw}))[column]
+                bin_values[column] = raw.groupby(binned.to_numpy()).median().to_dict()
+        else:
+            # Labels in the format of the items of the model (commas replaced with tildes)
+            pairs = pd.DataFrame({'label': labels[column].str.replace(",", "~"), 'code': codes[column]})
+            levels[column] = dict(pairs.drop_duplicates('label').itertuples(index=False))
+
+    return {'features': features, 'levels': levels, 'bins': bin_values,
+            'classes': [str(x) for x in sorted(codes['Class'].unique())]}
+
+
+def encode(encoder, applications):
+    """
+    Encodes applications as the features of the XGBoost model. Numeric attributes can be raw
+    numbers or bin labels; unknown levels are missing values.
+
+    Args:
+        encoder (dict): Encoder returned by fit_encoder.
+        applications (DataFrame): Applications, with the column names of the training data.
+
+    Returns:
+        tuple: The features, one row per application, and whether every numeric attribute of every
+        row was a raw number (False when the value of some bin was used instead).
+    """
+    features = np.full((len(applications), len(encoder['features'])), np.nan, dtype=np.float32)
+    exact = np.ones(len(applications), dtype=bool)
+    for j, column in enumerate(encoder['features']):
+        if column not in applications:
+            continue
+        values = applications[column].astype(str).str.strip()
+        if column in encoder['levels']:
+            features[:, j] = values.map(encoder['levels'][column]).to_numpy(dtype=np.float64)
+        else:
+            raw = pd.to_numeric(values, errors="coerce")
+            binned = raw.isna()
+            exact &= ~binned.to_numpy()
+            features[:, j] = raw.where(~binned, values.map(encoder['bins'].get(column, {}))).to_numpy(dtype=np.float64)
+    return features, exact
@@ -0,0 +1,456 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+from admission import Rejected
+from metrics import Metrics, span
+
+
+# Model attached by every worker process
+model = None
+
+# Timing spans of the task running in the worker process
+spans = []
+
+# Sampling profiler of the worker process, if profiling is enabled
+profiler = None
+
+
+def export_model(model_args, directory, discretizer_path=None):
+    """
+    Builds (or loads the snapshot of) the R classifier and exports it once as a directory
+    of memory-mappable arrays, again if the directory was written with an older format
+    (see npCBA.FORMAT_VERSION). Meant to be run in its own process before the workers start.
+
+    Args:
+        model_args (tuple): Arguments of pyCBA.init_model.
+        directory (str): Directory where the exported models are kept.
+        discretizer_path (str, optional): File path of the fitted discretizer saved with the model (default is None).
+
+    Returns:
+        str: Path of the exported model, one per model version.
+    """
+    import discretizer
+    import npCBA
+    import pyCBA
+    classifier = pyCBA.init_model(*model_args)
+    path = os.path.join(directory, "engine_" + pyCBA.model_version(classifier))
+    # Export again the models written with an older layout of the arrays
+    if npCBA.saved_format(path) != npCBA.FORMAT_VERSION:
+        os.makedirs(directory, exist_ok=True)
+        bins = None
+        if discretizer_path is not None and os.path.exists(discretizer_path):
+            bins = discretizer.load_discretizer(discretizer_path)
+        pyCBA.export_model(classifier, path, bins)
+    return path
+
+
+def init_worker(model_path, profile_dir=None):
+    """
+    Attaches a worker process to the exported model. The arrays are memory-mapped read-only,
+    so all the workers share a single copy of the rules, the items and the rule table.
+    The workers do not start an R interpreter, the audit log is written by audit.AuditLog.
+
+    Args:
+        model_path (str): Path returned by export_model.
+        profile_dir (str, optional): Directory where the worker writes its sampling profile,
+            profiling is disabled if it is None (default is None).
+    """
+    global model, profiler
+    import npCBA
+    from profiler import start_profiler
+    model = npCBA.load_model(model_path)
+    profiler = start_profiler(profile_dir)
+
+
+def timed(func, *args):
+    """
+    Runs a function inside a worker and collects the timing spans of its stages.
+
+    Args:
+        func (callable): Module-level function to run.
+        *args: Arguments of the function.
+
+    Returns:
+        tuple: The result of the function and its spans, as pairs of stage and duration in seconds.
+    """
+    spans.clear()
+    with span(spans, "worker"):
+        result = func(*args)
+    return result, list(spans)
+
+
+def ping():
+    """
+    Health check run inside a worker.
+
+    Returns:
+        int: Process id of the worker.
+    """
+    return os.getpid()
+
+
+def model_version():
+    """
+    Returns:
+        str: Version of the model attached by the worker.
+    """
+    return str(model['version'])
+
+
+def predict(to_predict, get_rules=False):
+    """
+    Makes a prediction with the shared model inside a worker. It is logged by the API process.
+
+    Args:
+        to_predict (DataFrame): New data to make predictions on.
+        get_rules (bool, optional): Whether to return the rules used for prediction (default is False).
+
+    Returns:
+        tuple: A tuple containing the prediction and optionally the indices (starting at 0) of the
+        rules used for prediction, which npCBA.explain and npCBA.contributions turn into explanations.
+    """
+    import npCBA
+    with span(spans, "predict"):
+        prediction, rule_ids = npCBA.predict_model(model, to_predict, True)
+    prediction = str(prediction[0])
+    rule_ids = [int(i) for i in rule_ids[0]]
+    return prediction, rule_ids if get_rules else None
+
+
+def predict_many(to_predict, get_rules=False):
+    """
+    Makes many predictions with the shared model inside a worker. They are logged by the API process.
+
+    Args:
+        to_predict (DataFrame): New data to make predictions on, one row per application.
+        get_rules (bool, optional): Whether to return the indices of the rules used for every prediction (default is False).
+
+    Returns:
+        tuple: A tuple containing the list of predictions and optionally the list of rule indices
+        (starting at 0) used for every prediction.
+    """
+    import npCBA
+    with span(spans, "predict"):
+        predictions, rule_ids = npCBA.predict_model(model, to_predict, True)
+    predictions = [str(p) for p in predictions]
+    rules = [[int(i) for i in ids] for ids in rule_ids]
+    return predictions, rules if get_rules else None
+
+
+class InferencePool:
+    """
+    Pool of worker processes that can be awaited from the async handlers of the API without
+    blocking the event loop. The model is exported once and all the workers attach to the same
+    read-only copy of it. Tasks are only handed to the workers when there is a free slot; the
+    others wait in the event loop, where they are rejected if the queue is full or dropped
+    if their deadline passes before a slot is free.
+
+    Args:
+        model_args (tuple): Arguments of pyCBA.init_model.
+        workers (int, optional): Number of worker processes (default is 1).
+        queue_size (int, optional): Maximum number of tasks waiting for a free slot (default is 64).
+        health_timeout (float, optional): Seconds an idle worker has to answer a health check (default is 60).
+        model_dir (str, optional): Directory where the exported models are kept (default is "models").
+        discretizer_path (str, optional): File path of the fitted discretizer saved with the model (default is None).
+        metrics (Metrics, optional): Metrics where the timing spans of the tasks are observed (default is a new one).
+        profile_dir (str, optional): Directory where every worker writes its sampling profile,
+            profiling is disabled if it is None (default is None).
+        max_in_flight (int, optional): Maximum number of tasks handed to the workers at once (default is workers).
+    """
+
+    def __init__(self, model_args, workers=1, queue_size=64, health_timeout=60, model_dir="models", discretizer_path=None,
+                 metrics=None, profile_dir=None, max_in_flight=None):
+        self.model_args = model_args
+        self.model_dir = model_dir
+        self.discretizer_path = discretizer_path
+        self.model_path = None
+        self.workers = workers
+        self.queue_size = queue_size
+        self.health_timeout = health_timeout
+        self.executor = None
+        self.max_in_flight = max_in_flight or workers
+        self.slots = None
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of the seconds every task takes, used to estimate when to retry
+        self.task_seconds = 0.0
+        self.restarts = 0
+        self.version = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.profile_dir = profile_dir
+
+    def start(self):
+        """
+        Exports the model, if it was not exported yet, and starts the worker processes attached to it.
+        """
+        # R cannot be forked safely, every process starts a fresh interpreter
+        context = multiprocessing.get_context("spawn")
+        if self.model_path is None:
+            # The classifier is only built in this short-lived process, never in the workers
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as exporter:
+                self.model_path = exporter.submit(export_model, self.model_args, self.model_dir,
+                                                  self.discretizer_path).result()
+
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=context,
+                                            initializer=init_worker,
+                                            initargs=(self.model_path, self.profile_dir))
+        for _ in range(self.workers):
+            self.executor.submit(ping)
+
+    def stop(self):
+        """
+        Stops the worker processes, cancelling the tasks that have not started.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def restart(self, executor):
+        """
+        Replaces the worker processes, unless they were already replaced.
+
+        Args:
+            executor (ProcessPoolExecutor): The executor that failed.
+        """
+        if executor is not self.executor:
+            return
+        # Kill the workers in case they are hung
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.kill()
+        self.stop()
+        self.restarts += 1
+        self.version = None
+        self.start()
+
+    def retry_after(self):
+        """
+        Returns:
+            float: Estimated seconds until the tasks waiting now have been handed to the workers.
+        """
+        return (self.waiting + 1) * self.task_seconds / self.max_in_flight
+
+    def admit(self, tasks=1):
+        """
+        Checks that there is room in the queue for new tasks, without waiting.
+
+        Args:
+            tasks (int, optional): Number of tasks about to be run (default is 1).
+
+        Raises:
+            Rejected: If the queue is full.
+        """
+        if self.waiting + tasks > self.queue_size:
+            raise Rejected("overloaded", 503, self.retry_after())
+
+    async def run(self, func, *args, deadline=None, disconnected=None):
+        """
+        Runs a function in a worker process, waiting for a free slot in the queue.
+        If the workers crash, they are restarted and the task is retried once. The time waiting
+        in the queue, the time spent in the worker and in every stage, and the rest of the round
+        trip (serialization and transfer between processes) are observed as stages.
+
+        Args:
+            func (callable): Module-level function to run in the worker.
+            *args: Arguments of the function.
+            deadline (float, optional): Time, on the clock of time.monotonic, after which the task is
+                not run (default is None, no deadline).
+            disconnected (callable, optional): Coroutine function that tells whether the client is gone,
+                checked before the task is handed to a worker (default is None).
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Rejected: If the queue is full, the deadline passed or the client disconnected before a slot was free.
+        """
+        return (await self.run_many(func, [args], deadline=deadline, disconnected=disconnected))[0]
+
+    async def run_many(self, func, args_list, deadline=None, disconnected=None):
+        """
+        Runs a function in the worker processes once for every tuple of arguments, admitting the
+        tasks as a whole. The queue positions of all of them are reserved at once, so either all
+        of them are queued or none is, and if one is rejected while waiting, the others are
+        cancelled before they reach a worker.
+
+        Args:
+            func (callable): Module-level function to run in the workers.
+            args_list (list): Arguments of every task.
+            deadline (float, optional): Time, on the clock of time.monotonic, after which the tasks are
+                not run (default is None, no deadline).
+            disconnected (callable, optional): Coroutine function that tells whether the client is gone,
+                checked before every task is handed to a worker (default is None).
+
+        Returns:
+            list: The result of every task, in the same order as their arguments.
+
+        Raises:
+            Rejected: If the queue has no room for all the tasks, or if one of them was rejected while waiting.
+        """
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+
+        self.admit(len(args_list))
+        # Reserved queue positions, every task gives its own back when it gets a slot
+        tickets = [[True] for _ in args_list]
+        self.waiting += len(args_list)
+        try:
+            if len(args_list) == 1:
+                return [await self.dispatch(func, args_list[0], tickets[0], deadline, disconnected)]
+            tasks = [asyncio.ensure_future(self.dispatch(func, args, ticket, deadline, disconnected))
+                     for args, ticket in zip(args_list, tickets)]
+            try:
+                return await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            # Positions of the tasks cancelled before they started
+            for ticket in tickets:
+                self.leave_queue(ticket)
+
+    def leave_queue(self, ticket):
+        """
+        Gives back the queue position of a task, only once.
+
+        Args:
+            ticket (list): Whether the task still holds its position, as a one-element list.
+        """
+        if ticket[0]:
+            ticket[0] = False
+            self.waiting -= 1
+
+    async def dispatch(self, func, args, ticket, deadline=None, disconnected=None):
+        """
+        Waits for a free slot and runs a task admitted by run_many in a worker process. The slot
+        is freed when the worker is done with the task, even if the task is cancelled before.
+
+        Args:
+            func (callable): Module-level function to run in the worker.
+            args (tuple): Arguments of the function.
+            ticket (list): Queue position of the task, see leave_queue.
+            deadline (float, optional): Time after which the task is not run (default is None).
+            disconnected (callable, optional): Coroutine function that tells whether the client is gone (default is None).
+
+        Returns:
+            The result of the function.
+        """
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), None if deadline is None else deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            raise Rejected("deadline", 503, self.retry_after())
+        finally:
+            self.leave_queue(ticket)
+
+        future = None
+        counted = False
+        try:
+            self.metrics.observe_spans([("queue", time.perf_counter() - start)])
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Rejected("deadline", 503, self.retry_after())
+            if disconnected is not None and await disconnected():
+                raise Rejected("disconnected", 503, self.retry_after())
+            self.in_flight += 1
+            counted = True
+            for attempt in range(2):
+                executor = self.executor
+                start = time.perf_counter()
+                future = executor.submit(timed, func, *args)
+                try:
+                    result, task_spans = await asyncio.wrap_future(future)
+                    elapsed = time.perf_counter() - start
+                    self.task_seconds += 0.1 * (elapsed - self.task_seconds)
+                    worker = dict(task_spans).get("worker", 0.0)
+                    self.metrics.observe_spans(task_spans + [("ipc", elapsed - worker)])
+                    return result
+                except BrokenProcessPool:
+                    self.restart(executor)
+                    if attempt == 1:
+                        raise
+        finally:
+            if future is None or future.done():
+                self.release(counted)
+            else:
+                # The task was cancelled while a worker runs it: the slot stays taken until the worker is done
+                loop = asyncio.get_running_loop()
+                future.add_done_callback(lambda _: self.release_threadsafe(loop, counted))
+
+    def release(self, counted=True):
+        """
+        Frees the slot of a task once no worker is running it.
+
+        Args:
+            counted (bool, optional): Whether the task was counted in flight (default is True).
+        """
+        if counted:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def release_threadsafe(self, loop, counted):
+        """
+        Frees the slot of a task from the thread that completes its worker future.
+
+        Args:
+            loop (AbstractEventLoop): Event loop of the pool.
+            counted (bool): Whether the task was counted in flight.
+        """
+        try:
+            loop.call_soon_threadsafe(self.release, counted)
+        except RuntimeError:
+            # The event loop is closed, there is nothing left to free
+            pass
+
+    async def model_version(self):
+        """
+        Returns:
+            str: Version of the model attached by the workers, asked again after every restart.
+        """
+        if self.version is None:
+            self.version = await self.run(model_version)
+        return self.version
+
+    async def check(self):
+        """
+        Checks that the workers answer, restarting them if they do not.
+
+        Returns:
+            bool: Whether the workers were healthy.
+        """
+        executor = self.executor
+        # A busy pool is not checked, the ping would wait behind the predictions
+        if self.in_flight >= self.workers:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(executor.submit(ping)), self.health_timeout)
+            return True
+        except (asyncio.TimeoutError, BrokenProcessPool):
+            self.restart(executor)
+            return False
+
+    async def monitor(self, interval=30):
+        """
+        Checks the workers periodically. Meant to be run as a background task.
+
+        Args:
+            interval (float, optional): Seconds between health checks (default is 30).
+        """
+        while True:
+            await asyncio.sleep(interval)
+            await self.check()
+
+    def status(self):
+        """
+        Returns:
+            dict: Number of workers, maximum and current tasks in flight, tasks waiting, queue size
+            and restarts of the pool.
+        """
+        return {"workers": self.workers, "max_in_flight": self.max_in_flight, "in_flight": self.in_flight,
+                "waiting": self.waiting, "queue_size": self.queue_size, "restarts": self.restarts}
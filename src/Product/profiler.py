@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler of the main thread of a process. A background thread takes the stack of
+    the main thread at a fixed interval and periodically writes the number of samples of every
+    stack to a file, in the collapsed format read by flamegraph.pl and speedscope.
+
+    Args:
+        path (str): File where the collapsed stacks are written.
+        interval (float, optional): Seconds between samples (default is 0.01).
+        dump_every (float, optional): Seconds between writes of the file (default is 10).
+    """
+
+    def __init__(self, path, interval=0.01, dump_every=10):
+        self.path = path
+        self.interval = interval
+        self.dump_every = dump_every
+        self.stacks = Counter()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def collapse(frame):
+        """
+        Args:
+            frame (frame): Innermost frame of a stack.
+
+        Returns:
+            str: The functions of the stack from the outermost one, separated by semicolons.
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def start(self):
+        """
+        Starts sampling in a daemon thread.
+
+        Returns:
+            SamplingProfiler: The profiler itself.
+        """
+        self.thread = threading.Thread(target=self.run, args=(threading.main_thread().ident,), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops sampling and writes the file one last time.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self, ident):
+        """
+        Samples the stack of a thread until the profiler is stopped.
+
+        Args:
+            ident (int): Identifier of the sampled thread.
+        """
+        last_dump = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(ident)
+            if frame is not None:
+                self.stacks[self.collapse(frame)] += 1
+            if time.monotonic() - last_dump >= self.dump_every:
+                self.dump()
+                last_dump = time.monotonic()
+        self.dump()
+
+    def dump(self):
+        """
+        Replaces the file with the samples taken so far.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+        os.replace(tmp, self.path)
+
+
+def start_profiler(directory, interval=0.01):
+    """
+    Starts the sampling profiler of the current process, if profiling is enabled.
+
+    Args:
+        directory (str): Directory of the profiles, one file per process. Profiling is disabled if it is None or empty.
+        interval (float, optional): Seconds between samples (default is 0.01).
+
+    Returns:
+        SamplingProfiler: The started profiler, or None if profiling is disabled.
+    """
+    if not directory:
+        return None
+    return SamplingProfiler(os.path.join(directory, "profile_%d.txt" % os.getpid()), interval).start()
@@ -2,48 +2,86 @@ import pandas as pd
 import warnings
 import rpy2.robjects as robjects
 from rpy2.robjects import pandas2ri
+import npCBA
+import discretizer
 
 robjects.r.source("rCBA.R", encoding="UTF-8")
 pandas2ri.activate()
 
 
-def init_model(data, train_size, support, confidence):
+def init_model(data, train_size, support, confidence, prune=None):
     """
-    Initializes a model by calling the init_model function in R and extracting
-    transactions, rules, and weights.
+    Initializes a model by calling the init_model function in R, which mines the
+    rules and builds the classifier once.
     
     Args:
         data (str): File path of the filtered data. train_size (float): Ratio to
         split the data into training and testing sets. support (float): Minimum
         support threshold for CARs (Classification Association Rules).
         confidence (float): Minimum confidence threshold for CARs.
+        prune (dict, optional): Arguments of prune_model in R, for example
+        {"method": ["pessimistic", "coverage"], "max_rules": 500} (default is None, no pruning).
         
     Returns:
-        tuple: A tuple containing transactions, rules, and weights.
+        rpy2 object: The CBA classifier, with its default class already computed.
     """
 
     warnings.warn("Beware that you are using an AI model and that human supervision is necessary to make decisions.")
 
     # Call init_model function in R
-    l = robjects.r['init_model'](data, train_size, support, confidence)
+    if prune:
+        classifier = robjects.r['init_model'](data, train_size, support, confidence, prune=prune_args(prune))
+    else:
+        classifier = robjects.r['init_model'](data, train_size, support, confidence)
     
-    # Extract transactions, rules, and weights
-    transactions = l.rx2('transactions')  # Extract transactions from the R list
-    rules = l.rx2('rules')  # Extract rules from the R list
-    weights = l.rx2('weigths')  # Extract weights from the R list
+    return classifier
+
+
+
+def prune_args(prune):
+    """
+    Converts the pruning arguments to an R list.
     
-    return transactions, rules, weights
+    Args:
+        prune (dict): Arguments of prune_model in R.
+        
+    Returns:
+        rpy2 object: R list with the same arguments.
+    """
+    return robjects.vectors.ListVector({key: robjects.StrVector(value) if isinstance(value, (list, tuple))
+                                        else robjects.StrVector([value]) if isinstance(value, str)
+                                        else robjects.FloatVector([value])
+                                        for key, value in prune.items()})
 
 
+def update_model(data, train_size, support, confidence, delta, prune=None):
+    """
+    Updates a model with newly labeled rows by calling the update_model_version function in R,
+    which updates the rule counts instead of mining all the data again, and publishes the new
+    version. The next call to init_model with the same arguments loads the new version.
+    
+    Args:
+        data (str): File path of the filtered data the model was built from.
+        train_size (float): Ratio used to split the data into training and testing sets.
+        support (float): Minimum support threshold for CARs.
+        confidence (float): Minimum confidence threshold for CARs.
+        delta (str): File path of the new labeled rows, with the same columns as the filtered data.
+        prune (dict, optional): Pruning arguments the model was built with (default is None).
+        
+    Returns:
+        rpy2 object: The CBA classifier of the new version.
+    """
+    if prune:
+        return robjects.r['update_model_version'](data, train_size, support, confidence, delta, prune=prune_args(prune))
+    return robjects.r['update_model_version'](data, train_size, support, confidence, delta)
 
-def predict_model(transactions, rules, weights, to_predict, get_rules=False):
+
+def predict_model(classifier, to_predict, get_rules=False):
     """
     Makes predictions using a classification model based on association rules.
     
     Args:
-        transactions (DataFrame): Transactions used to train the model.
-        rules (list): Rules generated by the model.
-        weights (list): Weights associated with the transactions.
+        classifier (rpy2 object): Classifier returned by init_model.
         to_predict (list): New data to make predictions on.
         get_rules (bool, optional): Whether to return the rules used for prediction (default is False).
         
@@ -59,7 +97,7 @@ def predict_model(transactions, rules, weights, to_predict, get_rules=False):
         boolean = robjects.BoolVector([True])
     
     # Call predict_model function in R
-    l = robjects.r['predict_model'](transactions, rules, weights, to_predict, boolean)
+    l = robjects.r['predict_model'](classifier, to_predict, boolean)
     
     # Extract prediction and rules from the R list
     prediction = l[0][0]
@@ -68,9 +106,143 @@ def predict_model(transactions, rules, weights, to_predict, get_rules=False):
     return prediction, rules
 
 
+def model_version(classifier):
+    """
+    Returns the version of a classifier, the key of its snapshot.
+    
+    Args:
+        classifier (rpy2 object): Classifier returned by init_model.
+        
+    Returns:
+        str: Version of the classifier.
+    """
+    return str(classifier.rx2('version')[0])
+
+
+def log_prediction(to_predict, prediction, rules):
+    """
+    Writes a prediction made elsewhere (for example, taken from a cache) to the audit log.
+    
+    Args:
+        to_predict (DataFrame): Data of the prediction.
+        prediction (str): Prediction of the model.
+        rules (DataFrame): Rules used for the prediction.
+    """
+    robjects.r['log'](robjects.vectors.DataFrame(to_predict),
+                      robjects.StrVector([str(prediction)]),
+                      robjects.vectors.DataFrame(rules))
+
+
+def log_many(to_predict, predictions, rules, version=None, times=None, ids=None):
+    """
+    Writes many predictions made elsewhere (for example, by npCBA) to the audit log in a single block.
+    
+    Args:
+        to_predict (DataFrame): Data of the predictions, one row per application.
+        predictions (list): Prediction of every row.
+        rules (list): IDs of the rules used for every row, either their stable IDs (see npCBA.rule_id)
+            or their indices (starting at 1).
+        version (str, optional): Version of the model, whose rule catalog resolves the IDs (default is None).
+        times (list, optional): Time of every decision, in seconds since the epoch (default is None, the time of the write).
+        ids (list, optional): Unique ID of every record (default is None).
+    """
+    rules = [robjects.StrVector([str(x) for x in ids]) if any(isinstance(x, str) for x in ids)
+             else robjects.IntVector([int(x) for x in ids]) for ids in rules]
+    args = [robjects.vectors.DataFrame(to_predict),
+            robjects.StrVector([str(p) for p in predictions]),
+            robjects.r['list'](*rules)]
+    kwargs = {}
+    if version is not None:
+        kwargs['version'] = str(version)
+    if times is not None:
+        kwargs['time'] = robjects.FloatVector([float(t) for t in times])
+    if ids is not None:
+        kwargs['id'] = robjects.StrVector([str(x) for x in ids])
+    robjects.r['log_many'](*args, **kwargs)
+
+
+def close_log():
+    """
+    Saves the aggregates and the monitor state and closes the active segment of the audit log,
+    before the process that writes it exits.
+    """
+    robjects.r['log_shutdown']()
+
+
+def drain_spans():
+    """
+    Gets and clears the timing spans recorded by the R interpreter since the last call.
+    
+    Returns:
+        list: Pairs of stage and duration in seconds, in the order they ended.
+    """
+    spans = robjects.r['drain_spans']()
+    return list(zip([str(x) for x in spans.rx2('stage')], [float(x) for x in spans.rx2('seconds')]))
+
+
+def predict_many(classifier, to_predict, get_rules=False):
+    """
+    Makes predictions for many applications in a single call to R.
+    
+    Args:
+        classifier (rpy2 object): Classifier returned by init_model.
+        to_predict (DataFrame): New data to make predictions on, one row per application.
+        get_rules (bool, optional): Whether to return the indices of the rules used for every prediction (default is False).
+        
+    Returns:
+        tuple: A tuple containing the list of predictions and optionally the list of rule indices used for every prediction.
+    """
+    # Convert to_predict to R DataFrame
+    to_predict = robjects.vectors.DataFrame(to_predict)
+
+    # Call predict_many function in R
+    l = robjects.r['predict_many'](classifier, to_predict, robjects.BoolVector([get_rules]))
+
+    # Extract predictions and rules from the R list
+    predictions = [str(x) for x in l[0]]
+    rules = [[int(x) for x in ids] for ids in l[1]] if get_rules else None
+
+    return predictions, rules
+
+
+def export_model(classifier, path, bins=None):
+    """
+    Exports the rules of a classifier to the array-backed form used by npCBA,
+    so that predictions can be made without the R interpreter.
+    
+    Args:
+        classifier (rpy2 object): Classifier returned by init_model.
+        path (str): File path of the .npz file to write, or of the directory of
+            memory-mappable arrays (see npCBA.save_model).
+        bins (dict, optional): Discretizer of the numeric attributes, saved with the model. If it is
+            None, it is rebuilt from the interval labels of the items (default is None).
+        
+    Returns:
+        dict: The exported model, as returned by npCBA.load_model.
+    """
+    # Call export_rules function in R
+    l = robjects.r['export_rules'](classifier)
+
+    model = npCBA.build_model(item_labels=[str(x) for x in l.rx2('item_labels')],
+                              rule=[int(x) for x in l.rx2('rule')],
+                              item=[str(x) for x in l.rx2('item')],
+                              rhs=[str(x) for x in l.rx2('class')],
+                              support=[float(x) for x in l.rx2('support')],
+                              confidence=[float(x) for x in l.rx2('confidence')],
+                              weights=[float(x) for x in l.rx2('weights')],
+                              default=str(l.rx2('default')[0]),
+                              method=str(l.rx2('method')[0]),
+                              version=model_version(classifier),
+                              table=robjects.conversion.rpy2py(l.rx2('table')))
+    model.update(discretizer.to_arrays(bins if bins is not None else discretizer.from_labels(model['item_labels'])))
+    npCBA.save_model(model, path)
+
+    return npCBA.prepare_model(model)
+
+
 if __name__ == "__main__":
 
-    transactions, rules, weights = init_model("../data/Statlog_rCBA.csv", 0.7,0.01, 0.01)
+    classifier = init_model("../data/Statlog_rCBA.csv", 0.7,0.01, 0.01)
 
     df = pd.DataFrame({
         'Status.of.existing.checking.account': ['< 0 DM'],
@@ -95,7 +267,7 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("1 finished")
 
     df = pd.DataFrame({
@@ -121,7 +293,7 @@ if __name__ == "__main__":
         'Marital.Status': ['divorced/separated']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("2 finished")
 
     df = pd.DataFrame({
@@ -147,7 +319,7 @@ if __name__ == "__main__":
         'Marital.Status': ['married/widowed']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("3 finished")
 
     df = pd.DataFrame({
@@ -173,7 +345,7 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("4 finished")
 
     df = pd.DataFrame({
@@ -199,7 +371,7 @@ if __name__ == "__main__":
         'Marital.Status': ['married/widowed']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("5 finished")
 
     df = pd.DataFrame({
@@ -225,7 +397,7 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("6 finished")
 
     df = pd.DataFrame({
@@ -251,7 +423,7 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("7 finished")
 
     df = pd.DataFrame({
@@ -277,7 +449,7 @@ if __name__ == "__main__":
         'Marital.Status': ['divorced/separated']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("8 finished")
 
     df = pd.DataFrame({
@@ -303,7 +475,7 @@ if __name__ == "__main__":
         'Marital.Status': ['married/widowed']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("9 finished")
 
     df = pd.DataFrame({
@@ -329,7 +501,7 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("10 finished")
 
     df = pd.DataFrame({
@@ -355,7 +527,7 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("11 finished")
 
     df = pd.DataFrame({
@@ -381,7 +553,7 @@ if __name__ == "__main__":
         'Marital.Status': ['married/widowed']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("12 finished")
 
     df = pd.DataFrame({
@@ -407,5 +579,5 @@ if __name__ == "__main__":
         'Marital.Status': ['single']
     })
 
-    p = predict_model(transactions, rules, weights, df, True)
+    p = predict_model(classifier, df, True)
     print("13 finished")
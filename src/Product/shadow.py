@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import npXGB
+
+
+logger = logging.getLogger(__name__)
+
+# Attributes whose agreement is tracked separately, the same as the aggregates of the audit log
+SEGMENTS = ["Gender", "Foreign.worker", "Marital.Status", "Job"]
+
+# Segment of the values unknown to the encoder, so that clients cannot create new counters
+OTHER = "other"
+
+
+class ShadowScorer:
+    """
+    Scores the applications answered by the service again with the XGBoost model, off the request
+    path, and tracks how often both models agree. Applications are queued without waiting and scored
+    in batches by a background task, with one evaluation of all the trees per batch in a separate
+    thread. When the queue is full, new applications are dropped instead of slowing down the API.
+
+    Args:
+        model (dict): XGBoost model returned by npXGB.load_model.
+        encoder (dict): Encoder returned by npXGB.fit_encoder.
+        metrics (Metrics, optional): Metrics where the agreement counters are kept (default is None).
+        batch_size (int, optional): Applications that trigger a batch before the interval ends (default is 256).
+        interval (float, optional): Maximum seconds an application waits to be scored (default is 1).
+        max_queue (int, optional): Maximum number of applications waiting to be scored (default is 10000).
+        review_file (str, optional): JSON Lines file where the disagreements are written for review
+            (default is "log/shadow_disagreements.jsonl").
+        segments (list, optional): Attributes whose agreement is tracked by value (default is SEGMENTS).
+    """
+
+    def __init__(self, model, encoder, metrics=None, batch_size=256, interval=1.0, max_queue=10000,
+                 review_file="log/shadow_disagreements.jsonl", segments=SEGMENTS):
+        self.model = model
+        self.encoder = encoder
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.review_file = review_file
+        self.segments = segments
+        self.pending = []
+        self.queued = 0
+        self.ready = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.counts = {}
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def submit(self, applications, predictions, version=None):
+        """
+        Queues applications already answered by the service, without waiting for them to be scored.
+
+        Args:
+            applications (DataFrame): The applications as received, with raw numbers or bin labels.
+            predictions (list): Prediction of the service for every application.
+            version (str, optional): Version of the model that made the predictions (default is None).
+        """
+        if self.queued + len(applications) > self.max_queue:
+            self.dropped += len(applications)
+            return
+        self.pending.append((applications, [str(p) for p in predictions], version, time.time()))
+        self.queued += len(applications)
+        if self.ready is not None and self.queued >= self.batch_size:
+            self.ready.set()
+
+    async def run(self):
+        """
+        Scores the queued applications in batches. Meant to be run as a background task.
+        """
+        self.ready = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.ready.clear()
+            if not self.pending:
+                continue
+            batch, self.pending, self.queued = self.pending, [], 0
+            # The trees are evaluated in another thread, the counters are updated in the event loop.
+            # A failed batch is logged and skipped, the scorer keeps running
+            try:
+                counts = await loop.run_in_executor(self.executor, self.score, batch)
+            except Exception:
+                n = sum(len(b[0]) for b in batch)
+                logger.exception("%d applications could not be scored by the shadow model", n)
+                self.failed += n
+                if self.metrics is not None:
+                    self.metrics.inc("xai_shadow_failed_total", n)
+                continue
+            self.batches += 1
+            for key, n in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + n
+                if self.metrics is not None:
+                    attribute, value, result, kind = key
+                    if attribute is None:
+                        self.metrics.inc("xai_shadow_total", n, result=result, input=kind)
+                    else:
+                        self.metrics.inc("xai_shadow_segment_total", n, attribute=attribute, value=value,
+                                         result=result, input=kind)
+
+    def score(self, batch):
+        """
+        Scores a batch of applications with the XGBoost model and writes the disagreements.
+
+        Args:
+            batch (list): Applications, predictions, model versions and times queued by submit.
+
+        Returns:
+            dict: Number of applications by segment attribute and value (None for all of them, OTHER
+            for the values unknown to the encoder), result ("agree" or "disagree") and input ("raw" if all the numeric attributes were
+            numbers, "binned" if some were bin labels and their median training value was used).
+        """
+        applications = pd.concat([b[0] for b in batch], ignore_index=True)
+        predictions = np.array([p for b in batch for p in b[1]])
+        versions = [b[2] for b in batch for _ in b[1]]
+        times = [b[3] for b in batch for _ in b[1]]
+
+        features, exact = npXGB.encode(self.encoder, applications)
+        shadow, scores = npXGB.predict(self.model, features)
+        shadow = np.array(self.encoder['classes'])[shadow]
+        result = np.where(shadow == predictions, "agree", "disagree")
+        kind = np.where(exact, "raw", "binned")
+
+        frame = pd.DataFrame({"result": result, "input": kind})
+        counts = {(None, None, r, k): int(n) for (r, k), n in frame.groupby(["result", "input"]).size().items()}
+        for attribute in self.segments:
+            if attribute in applications:
+                values = applications[attribute].astype(str).str.strip()
+                known = set(self.encoder['levels'].get(attribute, {})) | set(self.encoder['bins'].get(attribute, {}))
+                frame["value"] = values.where(values.isin(known), OTHER).to_numpy()
+                for (v, r, k), n in frame.groupby(["value", "result", "input"]).size().items():
+                    counts[(attribute, v, r, k)] = int(n)
+
+        # Disagreements are appended for review, one JSON document per line
+        disagreements = np.flatnonzero(result == "disagree")
+        if len(disagreements) > 0:
+            os.makedirs(os.path.dirname(self.review_file) or ".", exist_ok=True)
+            with open(self.review_file, "a", encoding="utf-8") as f:
+                for i in disagreements:
+                    f.write(json.dumps({"time": times[i], "version": versions[i], "prediction": predictions[i],
+                                        "shadow": str(shadow[i]), "scores": scores[i].tolist(),
+                                        "input": kind[i], "application": applications.iloc[i].to_dict()}) + "\n")
+        return counts
+
+    def stop(self):
+        """
+        Stops the thread of the scorer, the applications still queued are not scored.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Applications scored, agreement rate (overall, by input and by segment), applications
+            queued, dropped and not scored because of an error, and batches scored.
+        """
+        def rate(agree, disagree):
+            return agree / (agree + disagree) if agree + disagree else None
+
+        totals = {}
+        for (attribute, value, result, kind), n in self.counts.items():
+            for key in ([(None, None), (None, kind)] if attribute is None else [(attribute, value)]):
+                totals.setdefault(key, {"agree": 0, "disagree": 0})[result] += n
+
+        overall = totals.get((None, None), {"agree": 0, "disagree": 0})
+        return {"scored": overall["agree"] + overall["disagree"],
+                "agreement": rate(overall["agree"], overall["disagree"]),
+                "by_input": {kind: rate(c["agree"], c["disagree"]) for (a, kind), c in totals.items()
+                             if a is None and kind is not None},
+                "by_segment": {a: {v: rate(c["agree"], c["disagree"]) for (a2, v), c in totals.items() if a2 == a}
+                               for a in self.segments},
+                "queued": self.queued, "dropped": self.dropped, "failed": self.failed, "batches": self.batches}
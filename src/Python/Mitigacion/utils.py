@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+from Preprocesamiento.utils import read_chunks, write_chunks
+
+
+# Groups used when the privileged and unprivileged groups are given, rows in neither group keep a weight of 1
+PRIVILEGED = 'privileged'
+UNPRIVILEGED = 'unprivileged'
+OTHER = 'other'
+
+
+def group_keys(data, protected_attributes, label='Class', privileged=None, unprivileged=None):
+    '''
+    Gets the group and the label of every row.
+
+    Args:
+    - data (pd.DataFrame): The data, with the protected attributes and the label.
+    - protected_attributes (list): Names of the protected attributes.
+    - label (str): Name of the label column.
+    - privileged (dict): Values of the protected attributes of the privileged group. If it and unprivileged
+      are None, every combination of values of the protected attributes is a group.
+    - unprivileged (dict): Values of the protected attributes of the unprivileged group.
+
+    Returns:
+    - pd.DataFrame: One row per row of the data, with the group columns followed by the label.
+    '''
+    if privileged is None and unprivileged is None:
+        keys = data[list(protected_attributes)].astype(object).fillna('').astype(str)
+    else:
+        # A row is in a group when all its protected attributes have the values of the group
+        group = np.full(len(data), OTHER, dtype=object)
+        for name, values in ((UNPRIVILEGED, unprivileged), (PRIVILEGED, privileged)):
+            if values:
+                member = np.logical_and.reduce([(data[column] == value).to_numpy() for column, value in values.items()])
+                group[member] = name
+        keys = pd.DataFrame({'group': group}, index=data.index)
+
+    keys[label] = data[label].astype(str).to_numpy()
+    return keys
+
+def update_counts(counts, data, protected_attributes, label='Class', privileged=None, unprivileged=None):
+    '''
+    Adds the rows of a chunk to the counts of every group and label, for streaming input.
+
+    Args:
+    - counts (pd.Series): Counts returned by a previous call, or None for the first chunk.
+    - data (pd.DataFrame): The chunk.
+    - protected_attributes, label, privileged, unprivileged: As in group_keys.
+
+    Returns:
+    - pd.Series: Number of rows of every group and label, indexed by the group columns and the label.
+    '''
+    keys = group_keys(data, protected_attributes, label, privileged, unprivileged)
+    chunk_counts = keys.groupby(list(keys.columns)).size()
+    if counts is None:
+        return chunk_counts
+    return counts.add(chunk_counts, fill_value=0)
+
+def count_groups(chunks, protected_attributes, label='Class', privileged=None, unprivileged=None):
+    '''
+    Counts the rows of every group and label in a single pass over the chunks.
+
+    Args:
+    - chunks (iterable of pd.DataFrame): The data, in one or more chunks.
+    - protected_attributes, label, privileged, unprivileged: As in group_keys.
+
+    Returns:
+    - pd.Series: Number of rows of every group and label.
+    '''
+    counts = None
+    for chunk in chunks:
+        counts = update_counts(counts, chunk, protected_attributes, label, privileged, unprivileged)
+    return counts
+
+def compute_weights(counts):
+    '''
+    Computes the reweighing weights (Kamiran and Calders) of every group and label,
+    P(group) * P(label) / P(group, label), which make the label independent of the group.
+
+    Args:
+    - counts (pd.Series): Counts returned by count_groups.
+
+    Returns:
+    - pd.Series: Weight of every group and label, with the same index as the counts.
+    '''
+    group_levels = list(range(counts.index.nlevels - 1))
+    n = counts.sum()
+    group_counts = counts.groupby(level=group_levels).transform('sum')
+    label_counts = counts.groupby(level=-1).transform('sum')
+    weights = group_counts * label_counts / (n * counts)
+
+    # Rows outside the privileged and unprivileged groups are not reweighed
+    if counts.index.names[0] == 'group' and counts.index.nlevels == 2:
+        weights[counts.index.get_level_values(0) == OTHER] = 1.0
+
+    return weights.rename('Weights')
+
+def apply_weights(data, weights, protected_attributes, label='Class', privileged=None, unprivileged=None):
+    '''
+    Adds the Weights column to the data, looking up the weight of the group and label of every row.
+
+    Args:
+    - data (pd.DataFrame): The data, in one chunk.
+    - weights (pd.Series): Weights returned by compute_weights.
+    - protected_attributes, label, privileged, unprivileged: As in group_keys.
+
+    Returns:
+    - pd.DataFrame: The data with the Weights column, 1 for groups that were not counted.
+    '''
+    keys = group_keys(data, protected_attributes, label, privileged, unprivileged)
+    index = weights.index.get_indexer(pd.MultiIndex.from_frame(keys))
+    data = data.copy()
+    data['Weights'] = np.where(index >= 0, weights.to_numpy()[index], 1.0)
+    return data
+
+def reweigh(data, protected_attributes, label='Class', privileged=None, unprivileged=None):
+    '''
+    Adds the Weights column to data that fits in memory.
+
+    Args:
+    - data (pd.DataFrame): The data, with the protected attributes and the label.
+    - protected_attributes, label, privileged, unprivileged: As in group_keys.
+
+    Returns:
+    - pd.DataFrame: The data with the Weights column.
+    '''
+    weights = compute_weights(count_groups([data], protected_attributes, label, privileged, unprivileged))
+    return apply_weights(data, weights, protected_attributes, label, privileged, unprivileged)
+
+def reweigh_file(input_path, output_path, protected_attributes, label='Class', privileged=None, unprivileged=None,
+                 chunksize=100000):
+    '''
+    Adds the Weights column to a csv or parquet file in chunks: a first pass counts the groups and labels
+    and a second pass appends every chunk with its weights to the output file.
+
+    Args:
+    - input_path (str): Path of the csv or parquet file.
+    - output_path (str): Path of the csv or parquet file with the Weights column, overwritten if it exists.
+    - protected_attributes, label, privileged, unprivileged: As in group_keys.
+    - chunksize (int): Number of rows processed at once.
+
+    Returns:
+    - pd.Series: The weight of every group and label.
+    '''
+    weights = compute_weights(count_groups(read_chunks(input_path, chunksize),
+                                           protected_attributes, label, privileged, unprivileged))
+    write_chunks((apply_weights(chunk, weights, protected_attributes, label, privileged, unprivileged)
+                  for chunk in read_chunks(input_path, chunksize)), output_path)
+    return weights
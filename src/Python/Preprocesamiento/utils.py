@@ -38,12 +38,37 @@ def read_german_dataset():
                   
 def load_data(file_path: str) -> pd.DataFrame:
     '''
-    This function reads a csv file and returns a pandas DataFrame.
+    This function reads a csv, parquet or feather file and returns a pandas DataFrame.
+    The categorical columns of parquet and feather files are read with their categories, in the same order.
     '''
     # Load the dataset
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path)
+    if file_path.endswith('.feather'):
+        return pd.read_feather(file_path)
     df = pd.read_csv(file_path)
     return df
 
+def to_categorical(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    This function converts the text columns of a DataFrame to categorical columns, keeping the categorical ones as they are.
+    '''
+    return df.astype({column: 'category' for column in df.columns
+                      if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])})
+
+def save_data(df: pd.DataFrame, file_path: str):
+    '''
+    This function writes a DataFrame to a csv, parquet or feather file, depending on the extension of the path.
+    In parquet and feather files the text columns are dictionary-encoded, so every level is written only once
+    and R reads them as factors with the same levels.
+    '''
+    if file_path.endswith('.parquet'):
+        to_categorical(df).to_parquet(file_path, index=False)
+    elif file_path.endswith('.feather'):
+        to_categorical(df).reset_index(drop=True).to_feather(file_path)
+    else:
+        df.to_csv(file_path, index=False)
+
 def get_missing_values(data: pd.DataFrame) -> pd.DataFrame:
     '''
     This function returns the columns with missing values and the number of missing values for each column.
@@ -58,75 +83,124 @@ def get_missing_values(data: pd.DataFrame) -> pd.DataFrame:
         [print(i) for i in na_columns]
 
 
+# Mapping of the attribute codes of the Statlog dataset to their labels
+CATEGORIES = {
+    'A11': '< 0 DM',
+    'A12': '0 - 200 DM',
+    'A13': '>= 200 DM',
+    'A14': 'no checking account',
+    'A30': 'no credits/all paid',
+    'A31': 'all credits paid',
+    'A32': 'existing credits paid',
+    'A33': 'delay in paying',
+    'A34': 'critical account',
+    'A40': 'car (new)',
+    'A41': 'car (used)',
+    'A42': 'furniture/equipment',
+    'A43': 'radio/television',
+    'A44': 'domestic appliances',
+    'A45': 'repairs',
+    'A46': 'education',
+    'A47': 'vacation',
+    'A48': 'retraining',
+    'A49': 'business',
+    'A410': 'others',
+    'A61': '< 100 DM',
+    'A62': '100 - 500 DM',
+    'A63': '500 - 1000 DM',
+    'A64': '>= 1000 DM',
+    'A65': 'unknown/no savings',
+    'A71': 'unemployed',
+    'A72': '< 1 year',
+    'A73': '1 - 4 years',
+    'A74': '4 - 7 years',
+    'A75': '>= 7 years',
+    'A91': 'male: divorced/separated',
+    'A92': 'female: divorced/separated/married',
+    'A93': 'male: single',
+    'A94': 'male: married/widowed',
+    'A95': 'female: single',
+    'A101': 'none',
+    'A102': 'co-applicant',
+    'A103': 'guarantor',
+    'A121': 'real estate',
+    'A122': 'building society savings',
+    'A123': 'car or other',
+    'A124': 'unknown/no property',
+    'A141': 'bank',
+    'A142': 'stores',
+    'A143': 'none',
+    'A151': 'rent',
+    'A152': 'own',
+    'A153': 'for free',
+    'A171': 'unemployed/non-resident',
+    'A172': 'unskilled resident',
+    'A173': 'skilled employee',
+    'A174': 'management/self-employed',
+    'A191': 'none',
+    'A192': 'yes, registered',
+    'A201': 'yes',
+    'A202': 'no'
+}
+
+# Mapping of the personal status and sex labels to the gender and the marital status
+PERSONAL_STATUS = {
+    'male: divorced/separated': ('male', 'divorced/separated'),
+    'female: divorced/separated/married': ('female', 'divorced/separated/married'),
+    'male: single': ('male', 'single'),
+    'male: married/widowed': ('male', 'married/widowed'),
+    'female: single': ('female', 'single')
+}
+
+# Lookup arrays compiled once from the mappings: the position of a code (or of a personal
+# status) gives the position of its label, and the extra last element is used for unknown values.
+# Codes are 'A' + attribute number + value number, 'others' (A410) is the only two-digit value
+CODES = pd.Index(list(CATEGORIES))
+CODE_ATTRIBUTE = np.array(['4' if code == 'A410' else code[1:-1] for code in CATEGORIES])
+ATTRIBUTE_LOOKUPS = {}
+for attribute in pd.unique(CODE_ATTRIBUTE):
+    codes = CODES[CODE_ATTRIBUTE == attribute]
+    labels = pd.Index(pd.unique(pd.Series([CATEGORIES[code] for code in codes])))
+    ATTRIBUTE_LOOKUPS[attribute] = (codes, np.append(labels.get_indexer([CATEGORIES[code] for code in codes]), -1), labels)
+
+STATUSES = pd.Index(list(PERSONAL_STATUS))
+GENDERS = pd.Index(pd.unique(pd.Series([gender for gender, _ in PERSONAL_STATUS.values()])))
+MARITAL_STATUSES = pd.Index(pd.unique(pd.Series([status for _, status in PERSONAL_STATUS.values()])))
+STATUS_TO_GENDER = np.append(GENDERS.get_indexer([gender for gender, _ in PERSONAL_STATUS.values()]), -1)
+STATUS_TO_MARITAL = np.append(MARITAL_STATUSES.get_indexer([status for _, status in PERSONAL_STATUS.values()]), -1)
+
+
+def lookup(values, keys, key_to_label, labels):
+    """
+    Maps the values of a column to labels through precompiled lookup arrays.
+
+    Args:
+    - values (pd.Series): The values to map.
+    - keys (pd.Index): The known values.
+    - key_to_label (np.ndarray): Position in labels of every known value, followed by -1.
+    - labels (pd.Index): The labels.
+
+    Returns:
+    - pd.Categorical: The label of every value, missing for unknown values.
+    """
+    # get_indexer gives -1 for unknown values, which picks the last element of key_to_label
+    return pd.Categorical.from_codes(key_to_label[keys.get_indexer(values)], categories=labels)
+
+
 def replace_categorical_values(df):
     '''
     This function replaces the categorical values in the dataset with the corresponding attribute mapping.
+    The replaced columns are stored as categorical columns.
     '''
-    # Define mapping for each attribute
-    categories = {
-        'A11': '< 0 DM',
-        'A12': '0 - 200 DM',
-        'A13': '>= 200 DM',
-        'A14': 'no checking account',
-        'A30': 'no credits/all paid',
-        'A31': 'all credits paid',
-        'A32': 'existing credits paid',
-        'A33': 'delay in paying',
-        'A34': 'critical account',
-        'A40': 'car (new)',
-        'A41': 'car (used)',
-        'A42': 'furniture/equipment',
-        'A43': 'radio/television',
-        'A44': 'domestic appliances',
-        'A45': 'repairs',
-        'A46': 'education',
-        'A47': 'vacation',
-        'A48': 'retraining',
-        'A49': 'business',
-        'A410': 'others',
-        'A61': '< 100 DM',
-        'A62': '100 - 500 DM',
-        'A63': '500 - 1000 DM',
-        'A64': '>= 1000 DM',
-        'A65': 'unknown/no savings',
-        'A71': 'unemployed',
-        'A72': '< 1 year',
-        'A73': '1 - 4 years',
-        'A74': '4 - 7 years',
-        'A75': '>= 7 years',
-        'A91': 'male: divorced/separated',
-        'A92': 'female: divorced/separated/married',
-        'A93': 'male: single',
-        'A94': 'male: married/widowed',
-        'A95': 'female: single',
-        'A101': 'none',
-        'A102': 'co-applicant',
-        'A103': 'guarantor',
-        'A121': 'real estate',
-        'A122': 'building society savings',
-        'A123': 'car or other',
-        'A124': 'unknown/no property',
-        'A141': 'bank',
-        'A142': 'stores',
-        'A143': 'none',
-        'A151': 'rent',
-        'A152': 'own',
-        'A153': 'for free',
-        'A171': 'unemployed/non-resident',
-        'A172': 'unskilled resident',
-        'A173': 'skilled employee',
-        'A174': 'management/self-employed',
-        'A191': 'none',
-        'A192': 'yes, registered',
-        'A201': 'yes',
-        'A202': 'no'
-    }
-
-
     # Iterate through each column and replace categorical values
     for column in df.columns:
-        if df[column].dtype == 'object':
-            df[column] = df[column].map(categories)
+        if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
+            # The categories of the column are the labels of the attribute of its codes
+            known = CODES.get_indexer(df[column])
+            if not np.any(known >= 0):
+                df[column] = pd.Series(np.nan, index=df.index, dtype=object)
+                continue
+            df[column] = lookup(df[column], *ATTRIBUTE_LOOKUPS[CODE_ATTRIBUTE[known[known >= 0][0]]])
 
     return df
 
@@ -135,34 +209,87 @@ def split_personal_status_and_sex(data):
     Split the 'Personal status and sex' column into 'Gender' and 'Marital Status'.
 
     Args:
-    - data (pd.Series): The series containing the 'Personal status and sex' column.
+    - data (pd.DataFrame): The data containing the 'Personal status and sex' column.
 
     Returns:
     - pd.DataFrame: DataFrame with 'Gender' and 'Marital Status' columns.
     """
-    # Mapping of categories to separate gender and marital status
-    category_mapping = {
-        'male: divorced/separated': ('male', 'divorced/separated'),
-        'female: divorced/separated/married': ('female', 'divorced/separated/married'),
-        'male: single': ('male', 'single'),
-        'male: married/widowed': ('male', 'married/widowed'),
-        'female: single': ('female', 'single')
-    }
+    status = data.pop('Personal status and sex').astype(object)
 
-    # Splitting the column based on the mapping
-    split_data = data['Personal status and sex'].map(category_mapping)
+    # Splitting the column by indexing the lookup arrays, keeping the index of the data
+    data['Gender'] = pd.Series(lookup(status, STATUSES, STATUS_TO_GENDER, GENDERS), index=data.index)
+    data['Marital Status'] = pd.Series(lookup(status, STATUSES, STATUS_TO_MARITAL, MARITAL_STATUSES), index=data.index)
 
-    # Creating new DataFrame with separated columns
-    new_data = pd.DataFrame(split_data.tolist(), columns=['Gender', 'Marital Status'])
+    # the column 'Class' is the last column in the dataset, so we move it to the first position
+    class_col = data.pop('Class')
+    data.insert(0, 'Class', class_col)
 
-    # delete from new_data 'Personal status and sex'
-    data.drop('Personal status and sex', axis=1, inplace=True)
+    return data
 
-    # Concatenating the new DataFrame with the original DataFrame
-    new_data = pd.concat([data, new_data], axis=1)
+def read_chunks(file_path: str, chunksize: int = 100000):
+    '''
+    This function reads a csv or parquet file in chunks of rows, so that files larger than the memory can be processed.
 
-    # the column 'Class' is the last column in the dataset, so we move it to the first position
-    class_col = new_data.pop('Class')
-    new_data.insert(0, 'Class', class_col)
+    Args:
+    - file_path (str): Path of the csv or parquet file.
+    - chunksize (int): Number of rows of every chunk.
+
+    Returns:
+    - Iterator of pd.DataFrame: The chunks of the file, in order.
+    '''
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(file_path, chunksize=chunksize)
+
+def write_chunks(chunks, file_path: str) -> int:
+    '''
+    This function appends chunks of rows to a csv or parquet file as they arrive. The parquet file gets one row group
+    per chunk, so all the chunks must have the same columns and types (and the same categories in categorical columns).
+
+    Args:
+    - chunks (iterable of pd.DataFrame): The chunks to write.
+    - file_path (str): Path of the csv or parquet file, overwritten if it exists.
 
-    return new_data
+    Returns:
+    - int: Number of rows written.
+    '''
+    rows = 0
+    writer = None
+    for i, chunk in enumerate(chunks):
+        if file_path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(file_path, table.schema)
+            writer.write_table(table)
+        else:
+            chunk.to_csv(file_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        rows += len(chunk)
+
+    if writer is not None:
+        writer.close()
+
+    return rows
+
+def preprocess_file(input_path: str, output_path: str, chunksize: int = 100000) -> int:
+    '''
+    This function preprocesses a csv file with the raw Statlog columns in chunks of rows, replacing the
+    categorical values and splitting the personal status and sex, and appends every chunk to the output
+    file, so that files larger than the memory can be processed. The output is a parquet file if its
+    path ends with .parquet, with one row group per chunk, and a csv file otherwise.
+
+    Args:
+    - input_path (str): Path of the raw csv file.
+    - output_path (str): Path of the preprocessed csv or parquet file, overwritten if it exists.
+    - chunksize (int): Number of rows processed at once.
+
+    Returns:
+    - int: Number of rows written.
+    '''
+    # Every chunk gets the same categories, so all the row groups share the schema
+    return write_chunks((split_personal_status_and_sex(replace_categorical_values(chunk))
+                         for chunk in pd.read_csv(input_path, chunksize=chunksize)), output_path)
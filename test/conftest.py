@@ -0,0 +1,7 @@
+import os
+import sys
+
+
+# The API modules and the Python notebooks' modules are imported as top-level modules, as they are run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "src", "Product"), os.path.join(ROOT, "src", "Python")]
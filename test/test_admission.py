@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from admission import RateLimiter, Rejected, client_key, deadline
+from pool import InferencePool
+
+
+class FakeRequest:
+    def __init__(self, headers=None, host="10.0.0.1"):
+        self.headers = headers or {}
+        self.client = type("Client", (), {"host": host})()
+
+
+def test_rate_limiter_allows_a_burst_per_client():
+    limiter = RateLimiter(rate=1, burst=2)
+    limiter.check("a")
+    limiter.check("a")
+    with pytest.raises(Rejected) as rejected:
+        limiter.check("a")
+    assert rejected.value.reason == "rate_limit" and rejected.value.status == 429 and rejected.value.retry_after >= 1
+    limiter.check("b")
+
+
+def test_rate_limiter_disabled_and_bounded():
+    limiter = RateLimiter(rate=0, burst=1)
+    for _ in range(10):
+        limiter.check("a")
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    for client in "abc":
+        limiter.check(client)
+    assert list(limiter.buckets) == ["b", "c"]
+
+
+def test_client_key_and_deadline():
+    assert client_key(FakeRequest()) == "10.0.0.1"
+    assert client_key(FakeRequest({"X-Forwarded-For": "1.2.3.4, 10.0.0.1"}), "X-Forwarded-For") == "1.2.3.4"
+    now = time.monotonic()
+    assert deadline(FakeRequest({"x-request-timeout": "2"}), 30) - now < 3
+    assert deadline(FakeRequest({"x-request-timeout": "60"}), 30) - now < 31
+    assert deadline(FakeRequest({"x-request-timeout": "soon"}), 30) - now > 29
+
+
+def test_pool_rejects_batches_that_do_not_fit_in_the_queue():
+    pool = InferencePool(None, workers=1, queue_size=3)
+    with pytest.raises(Rejected) as rejected:
+        asyncio.run(pool.run_many(len, [("a",)] * 4))
+    assert rejected.value.reason == "overloaded" and rejected.value.status == 503
+    assert pool.waiting == 0
+
+
+def test_pool_drops_tasks_past_their_deadline():
+    pool = InferencePool(None, workers=1, queue_size=3)
+    with pytest.raises(Rejected) as rejected:
+        asyncio.run(pool.run_many(len, [("a",)] * 3, deadline=time.monotonic() - 1))
+    assert rejected.value.reason == "deadline"
+    assert pool.waiting == 0 and pool.in_flight == 0
+
+
+def test_cancelled_task_keeps_its_slot_until_the_worker_is_done():
+    pool = InferencePool(None, workers=1)
+    pool.executor = ThreadPoolExecutor(max_workers=1)
+    started, finish = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        finish.wait(5)
+
+    async def scenario():
+        task = asyncio.ensure_future(pool.run(busy))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # The worker still runs the task, a new task must wait for it
+        busy_status = pool.in_flight, pool.slots.locked()
+        finish.set()
+        assert await pool.run(len, "ab") == 2
+        return busy_status
+
+    try:
+        assert asyncio.run(scenario()) == (1, True)
+    finally:
+        pool.executor.shutdown()
+    assert pool.in_flight == 0 and not pool.slots.locked()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+import audit
+from admission import Rejected
+from audit import AuditLog
+
+
+class FakeWriter:
+    """
+    Writes the batches of the logger to a list instead of R, failing while asked to.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.failing = False
+        self.gate = None
+
+    def __call__(self, batch, directory=None):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.failing:
+            raise RuntimeError("R failed")
+        if directory is not None:
+            batch = audit.unwritten(batch, directory)
+        for to_predict, predictions, rules, version, times, ids in batch:
+            self.records += list(zip(ids, times, predictions))
+        return []
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = FakeWriter()
+    monkeypatch.setattr(audit, "write_records", writer)
+    monkeypatch.setattr(AuditLog, "start_logger", lambda self: setattr(self, "executor", ThreadPoolExecutor(1)))
+    monkeypatch.setattr(audit, "close_records", lambda: None)
+    return writer
+
+
+def applications(n):
+    return pd.DataFrame({"Job": ["skilled"] * n, "Gender": ["female"] * n})
+
+
+def test_decisions_are_written_before_submit_returns(writer, tmp_path):
+    async def scenario():
+        log = AuditLog(directory=str(tmp_path))
+        log.start()
+        before = time.time()
+        await asyncio.gather(log.submit(applications(2), ["1", "2"], [["a"], []], "v1"),
+                             log.submit(applications(1), ["2"], [["b"]], "v1"))
+        assert len(writer.records) == 3
+        assert all(before <= t <= time.time() for _, t, _ in writer.records)
+        await log.stop()
+        return log.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["written"] == 3 and stats["queued"] == 0
+
+
+def test_failed_batches_are_spilled_and_written_later(writer, tmp_path):
+    async def scenario():
+        log = AuditLog(retries=1, directory=str(tmp_path))
+        log.start()
+        writer.failing = True
+        await log.submit(applications(2), ["1", "2"], [["a"], []], "v1")
+        assert writer.records == [] and len(log.spill_files()) == 1
+        writer.failing = False
+        await log.submit(applications(1), ["2"], [["b"]], "v1")
+        await log.stop()
+        return log.stats()
+
+    stats = asyncio.run(scenario())
+    assert sorted(p for _, _, p in writer.records) == ["1", "2", "2"]
+    assert stats["spilled"] == 2 and not os.listdir(tmp_path / audit.SPILL_DIR)
+
+
+def test_spilled_batches_are_written_at_start(writer, tmp_path):
+    batch = [(applications(1), ["1"], [["a"]], "v1", [1.0], ["x"])]
+    audit.spill(batch, str(tmp_path / audit.SPILL_DIR / "1.jsonl"))
+
+    async def scenario():
+        log = AuditLog(directory=str(tmp_path))
+        log.start()
+        await log.stop()
+
+    asyncio.run(scenario())
+    assert writer.records == [("x", 1.0, "1")]
+
+
+def test_full_queue_applies_backpressure(writer, tmp_path):
+    async def scenario():
+        log = AuditLog(max_pending=2, directory=str(tmp_path))
+        log.start()
+        writer.gate = threading.Event()
+        first = asyncio.ensure_future(log.submit(applications(1), ["1"], [[]], "v1"))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(log.submit(applications(2), ["1", "2"], [[], []], "v1"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(Rejected) as rejected:
+            await log.submit(applications(1), ["1"], [[]], "v1", deadline=time.monotonic() + 0.05)
+        writer.gate.set()
+        await asyncio.gather(first, second)
+        await log.stop()
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == "log_queue" and rejected.status == 503
+    assert len(writer.records) == 3
+
+
+def test_records_already_in_the_log_are_not_written_again(tmp_path):
+    with open(tmp_path / "log_2024-01-01.jsonl", "w") as f:
+        f.write(json.dumps({"output": ["1"]}) + "\n")
+        for record_id in ["a", "b"]:
+            f.write(json.dumps({"output": ["1"], "id": [record_id]}) + "\n")
+        f.write('{"output": ["1"], "id": ["c"')
+    assert audit.written_ids(str(tmp_path), 10) == {"a", "b"}
+    batch = [(applications(2), ["1", "2"], [[], []], "v1", [1.0, 2.0], ["b", "c"])]
+    remaining = audit.unwritten(batch, str(tmp_path))
+    assert len(remaining) == 1 and remaining[0][5] == ["c"] and len(remaining[0][0]) == 1
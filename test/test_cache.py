@@ -0,0 +1,39 @@
+import pandas as pd
+import npCBA
+from cache import DecisionCache
+from test_npCBA import toy_model
+
+
+def test_cache_key_matches_the_values_seen_by_the_model():
+    assert DecisionCache.key(pd.DataFrame({"Job": ["a"], "Age": [30]})) == \
+        DecisionCache.key(pd.DataFrame({"Age": ["30"], "Job": ["a"]})) == (("Age", "30"), ("Job", "a"))
+    padded = pd.DataFrame({"Age": [" (0~30]"], "Job": ["b"]})
+    clean = pd.DataFrame({"Age": ["(0~30]"], "Job": ["b"]})
+    assert DecisionCache.key(padded) != DecisionCache.key(clean)
+    model = npCBA.prepare_model(toy_model())
+    assert npCBA.predict_model(model, padded)[0].tolist() != npCBA.predict_model(model, clean)[0].tolist()
+
+
+def test_cache_evicts_least_recently_used():
+    cache = DecisionCache(maxsize=2)
+    cache.put("v1", "a", 1)
+    cache.put("v1", "b", 2)
+    assert cache.get("v1", "a") == 1
+    cache.put("v1", "c", 3)
+    assert cache.get("v1", "b") is None
+    assert cache.get("v1", "a") == 1 and cache.get("v1", "c") == 3
+    assert cache.stats()["size"] == 2 and cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_cache_is_emptied_when_the_version_changes():
+    cache = DecisionCache()
+    cache.put("v1", "a", 1)
+    assert cache.get("v2", "a") is None
+    cache.put("v2", "a", 2)
+    assert cache.get("v2", "a") == 2
+
+
+def test_cache_disabled():
+    cache = DecisionCache(maxsize=0)
+    cache.put("v1", "a", 1)
+    assert cache.get("v1", "a") is None and cache.stats()["size"] == 0
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+import discretizer
+import main
+import npCBA
+from test_npCBA import toy_model
+
+
+def test_discretizer_from_labels():
+    bins = discretizer.from_labels(["Age=(30~60]", "Age=(0~30]", "Job=a", "Amount=(1~2]", "Amount=none"])
+    assert list(bins) == ["Age"]
+    edges, labels = bins["Age"]
+    assert edges.tolist() == [0, 30, 60] and labels.tolist() == ["(0~30]", "(30~60]"]
+
+
+def test_discretize_bins_are_closed_on_the_right():
+    bins = {"Age": (np.array([0.0, 30.0, 60.0]), np.array(["(0~30]", "(30~60]"]))}
+    data = pd.DataFrame({"Age": [30, 30.5, 60, "(0~30]"], "Job": ["a"] * 4})
+    binned = discretizer.discretize(bins, data)
+    assert binned["Age"].tolist() == ["(0~30]", "(30~60]", "(30~60]", "(0~30]"]
+    assert data["Age"].tolist()[0] == 30 and binned["Job"].tolist() == ["a"] * 4
+
+
+@pytest.mark.parametrize("age", [0, -5, 60.5, 99])
+def test_values_out_of_the_bins_are_rejected(age):
+    # The first edge is open, as in apply_discretizer, which gives these values no bin
+    bins = {"Age": (np.array([0.0, 30.0, 60.0]), np.array(["(0~30]", "(30~60]"]))}
+    with pytest.raises(ValueError, match="Age"):
+        discretizer.discretize(bins, pd.DataFrame({"Age": [20, age]}))
+
+
+def test_discretizer_is_saved_with_the_model(tmp_path):
+    model = toy_model()
+    model.update(discretizer.to_arrays(discretizer.from_labels(model["item_labels"])))
+    npCBA.save_model(model, str(tmp_path / "engine_v1"))
+    bins = discretizer.from_model(npCBA.load_model(str(tmp_path / "engine_v1")))
+    assert list(bins) == ["Age"] and bins["Age"][0].tolist() == [0, 30, 60]
+
+
+def test_raw_values_out_of_the_bins_get_a_400(monkeypatch):
+    model = npCBA.prepare_model(toy_model())
+    # The application is rejected before it reaches the workers, which are not started
+    monkeypatch.setattr(main.app.state, "model", model, raising=False)
+    monkeypatch.setattr(main.app.state, "bins", discretizer.from_labels(model["item_labels"]), raising=False)
+    response = TestClient(main.app).post("/sendApplications?raw=true", json=[{"Age": "99", "Job": "a"}])
+    assert response.status_code == 400
+    assert "Age" in response.json()["detail"]
@@ -0,0 +1,35 @@
+import metrics
+from metrics import Metrics
+
+
+def test_counters_and_gauges_are_rendered_with_their_help():
+    m = Metrics()
+    m.inc("xai_decisions_total", decision="good", source="model")
+    m.inc("xai_decisions_total", 2, decision="good", source="model")
+    m.inc("xai_rejected_total", path="/sendApplication", reason='a "quoted"\nreason\\')
+    text = m.render({"xai_pool_workers": 4})
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    # The metrics are rendered in the order of METRICS, each one after its help and type
+    start = lines.index("# HELP xai_pool_workers Worker processes of the inference pool.")
+    assert lines[start + 1:start + 3] == ["# TYPE xai_pool_workers gauge", "xai_pool_workers 4"]
+    assert lines.index("# TYPE xai_decisions_total counter") < start
+    assert 'xai_decisions_total{decision="good",source="model"} 3' in lines
+    assert 'xai_rejected_total{path="/sendApplication",reason="a \\"quoted\\"\\nreason\\\\"} 1' in lines
+    # Metrics without samples are left out
+    assert "xai_cache_size" not in text
+
+
+def test_histograms_have_cumulative_buckets():
+    m = Metrics(buckets=(0.01, 0.1))
+    m.observe_spans([("predict", 0.005), ("predict", 0.01), ("predict", 0.05), ("predict", 3.0)], prefix="r_")
+    lines = m.render().splitlines()
+    assert lines == [
+        "# HELP xai_stage_duration_seconds " + metrics.METRICS["xai_stage_duration_seconds"][1],
+        "# TYPE xai_stage_duration_seconds histogram",
+        'xai_stage_duration_seconds_bucket{stage="r_predict",le="0.01"} 2',
+        'xai_stage_duration_seconds_bucket{stage="r_predict",le="0.1"} 3',
+        'xai_stage_duration_seconds_bucket{stage="r_predict",le="+Inf"} 4',
+        'xai_stage_duration_seconds_sum{stage="r_predict"} 3.065',
+        'xai_stage_duration_seconds_count{stage="r_predict"} 4',
+    ]
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from Mitigacion.utils import OTHER, compute_weights, count_groups, reweigh, reweigh_file
+
+
+def biased_data():
+    return pd.DataFrame({"Gender": ["m"] * 6 + ["f"] * 4 + ["x"] * 2,
+                         "Age": ["young", "old"] * 6,
+                         "Class": ["good"] * 5 + ["bad"] + ["good"] + ["bad"] * 3 + ["good", "bad"]})
+
+
+def weighted_rate(data, group):
+    rows = data[group]
+    return rows["Weights"][rows["Class"] == "good"].sum() / rows["Weights"].sum()
+
+
+def test_reweighing_makes_the_label_independent_of_the_group():
+    data = reweigh(biased_data(), ["Gender"])
+    overall = (data["Class"] == "good").mean()
+    for gender in ["m", "f", "x"]:
+        assert np.isclose(weighted_rate(data, data["Gender"] == gender), overall)
+    # The weights keep the size of the data
+    assert np.isclose(data["Weights"].sum(), len(data))
+
+
+def test_reweighing_of_a_privileged_and_an_unprivileged_group():
+    data = reweigh(biased_data(), ["Gender"], privileged={"Gender": "m"}, unprivileged={"Gender": "f"})
+    assert (data["Weights"][data["Gender"] == "x"] == 1.0).all()
+    assert np.isclose(weighted_rate(data, data["Gender"] == "m"), weighted_rate(data, data["Gender"] == "f"))
+
+
+def test_counts_of_chunks_add_up():
+    data = biased_data()
+    counts = count_groups([data.iloc[:5], data.iloc[5:]], ["Gender", "Age"])
+    assert counts.equals(count_groups([data], ["Gender", "Age"]).astype(counts.dtype))
+    assert counts.sum() == len(data)
+    weights = compute_weights(count_groups([data], ["Gender"], privileged={"Gender": "m"}, unprivileged={"Gender": "f"}))
+    assert (weights[OTHER] == 1.0).all()
+
+
+def test_reweighing_a_file_in_chunks(tmp_path):
+    data = biased_data()
+    data.to_csv(tmp_path / "data.csv", index=False)
+    reweigh_file(str(tmp_path / "data.csv"), str(tmp_path / "weighted.csv"), ["Gender"], chunksize=5)
+    weighted = pd.read_csv(tmp_path / "weighted.csv")
+    assert np.allclose(weighted["Weights"], reweigh(data, ["Gender"])["Weights"])
@@ -0,0 +1,36 @@
+import os
+import pandas as pd
+import npCBA
+
+
+def toy_model(version="v1"):
+    return npCBA.build_model(item_labels=["Age=(0~30]", "Age=(30~60]", "Job=a", "Job=b", "Class=good", "Class=bad"],
+                             rule=[1, 2, 2], item=["Age=(0~30]", "Age=(30~60]", "Job=b"],
+                             rhs=["Class=bad", "Class=good"], support=[0.2, 0.3], confidence=[0.8, 0.9],
+                             weights=[1.0, 1.0], default="good", method="majority", version=version)
+
+
+def test_model_directories_of_an_older_format_are_replaced(tmp_path):
+    path = str(tmp_path / "engine_v1")
+    assert npCBA.saved_format(path) is None
+    npCBA.save_model(toy_model(), path)
+    assert npCBA.saved_format(path) == npCBA.FORMAT_VERSION
+    os.remove(os.path.join(path, npCBA.FORMAT_FILE))
+    assert npCBA.saved_format(path) == 0
+    npCBA.save_model(toy_model(), path)
+    assert npCBA.saved_format(path) == npCBA.FORMAT_VERSION
+    assert os.listdir(tmp_path) == ["engine_v1"]
+    prediction, rules = npCBA.predict_model(npCBA.load_model(path), pd.DataFrame({"Age": ["(30~60]"], "Job": ["b"]}), True)
+    assert prediction.tolist() == ["good"] and rules[0].tolist() == [1]
+
+
+def test_votes_ties_and_default_class():
+    model = npCBA.prepare_model(npCBA.build_model(
+        item_labels=["A=x", "B=y", "Class=good", "Class=bad"], rule=[1, 2], item=["A=x", "B=y"],
+        rhs=["Class=bad", "Class=good"], support=[0.2, 0.2], confidence=[0.9, 0.9], weights=[1.0, 1.0],
+        default="good", method="majority", version="v1"))
+    applicants = pd.DataFrame({"A": ["x", "x", "z"], "B": ["y", "z", "z"]})
+    prediction, rules = npCBA.predict_model(model, applicants, True)
+    # A tie goes to the first class level, an applicant without rules to the default class
+    assert prediction.tolist() == [str(model["classes"][0]), "bad", "good"]
+    assert [r.tolist() for r in rules] == [[0, 1], [0], []]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import npXGB
+
+xgboost = pytest.importorskip("xgboost")
+
+
+def train(objective, tmp_path, num_class=None):
+    rng = np.random.default_rng(0)
+    features = rng.integers(0, 6, size=(600, 5)).astype(np.float32)
+    features[rng.random(features.shape) < 0.05] = np.nan
+    labels = (np.nan_to_num(features[:, 0]) + np.nan_to_num(features[:, 1]) + rng.integers(0, 4, 600)) % (num_class or 2)
+    params = {"objective": objective, "max_depth": 4, "eta": 0.3, "seed": 0}
+    if num_class:
+        params["num_class"] = num_class
+    booster = xgboost.train(params, xgboost.DMatrix(features, label=labels), num_boost_round=20)
+    path = str(tmp_path / "model.json")
+    booster.save_model(path)
+    return booster, features, path
+
+
+@pytest.mark.parametrize("objective", ["binary:logistic", "reg:logistic", "binary:hinge"])
+def test_binary_predictions_match_xgboost(objective, tmp_path):
+    booster, features, path = train(objective, tmp_path)
+    expected = booster.predict(xgboost.DMatrix(features))
+    if objective != "binary:hinge":
+        expected = expected > 0.5
+    predicted, _ = npXGB.predict(npXGB.load_model(path), features)
+    assert (predicted == expected.astype(np.int64)).all()
+
+
+@pytest.mark.parametrize("objective", ["multi:softprob", "multi:softmax"])
+def test_multiclass_predictions_match_xgboost(objective, tmp_path):
+    booster, features, path = train(objective, tmp_path, num_class=3)
+    expected = booster.predict(xgboost.DMatrix(features))
+    if expected.ndim == 2:
+        expected = expected.argmax(axis=1)
+    predicted, _ = npXGB.predict(npXGB.load_model(path), features)
+    assert (predicted == expected.astype(np.int64)).all()
+
+
+def test_objectives_without_classes_are_rejected(tmp_path):
+    _, _, path = train("reg:squarederror", tmp_path)
+    with pytest.raises(ValueError):
+        npXGB.load_model(path)
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("rpy2")
+
+
+PRODUCT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "Product")
+
+
+@pytest.fixture(scope="module")
+def engines(tmp_path_factory):
+    """
+    The classifier built by R for the service and its export to npCBA, with the audit log of R in a
+    temporary directory. rCBA.R is sourced with paths relative to src/Product.
+    """
+    cwd = os.getcwd()
+    os.chdir(PRODUCT)
+    try:
+        import pyCBA
+        import npCBA
+        import rpy2.robjects as robjects
+        robjects.r["log_config"](str(tmp_path_factory.mktemp("log")))
+        classifier = pyCBA.init_model("../data/Statlog_rCBA.csv", 0.7, 0.01, 0.01)
+        model = pyCBA.export_model(classifier, str(tmp_path_factory.mktemp("models") / "engine"))
+        applicants = pd.read_csv("../data/Statlog_rCBA.csv").drop(columns=["Class", "Weights"], errors="ignore")
+        yield pyCBA, npCBA, robjects, classifier, model, applicants.astype(str)
+    finally:
+        os.chdir(cwd)
+
+
+def test_same_predictions_and_fired_rules(engines):
+    pyCBA, npCBA, robjects, classifier, model, applicants = engines
+    r_predictions, r_rules = pyCBA.predict_many(classifier, applicants, True)
+    np_predictions, np_rules = npCBA.predict_model(model, applicants, True)
+
+    assert np_predictions.tolist() == r_predictions
+    # R numbers the rules from 1
+    assert [(ids + 1).tolist() for ids in np_rules] == r_rules
+
+    # The ties of the vote and the applicants without rules are decided in the same way
+    scores = npCBA.match_rules(model, npCBA.encode(model, applicants)) @ model["votes"]
+    tied = np.sort(scores, axis=1)[:, -1] == np.sort(scores, axis=1)[:, -2]
+    uncovered = np.array([len(ids) == 0 for ids in np_rules])
+    assert str(model["default"]) == str(robjects.r["as.character"](classifier.rx2("default"))[0])
+    assert (np_predictions[uncovered] == str(model["default"])).all()
+    assert [p for p, t in zip(np_predictions, tied) if t] == [p for p, t in zip(r_predictions, tied) if t]
+
+
+def test_same_explanations(engines):
+    pyCBA, npCBA, robjects, classifier, model, applicants = engines
+    for i in range(0, len(applicants), 50):
+        applicant = applicants.iloc[[i]].reset_index(drop=True)
+        r_prediction, r_table = pyCBA.predict_model(classifier, applicant, True)
+        np_predictions, np_rules = npCBA.predict_model(model, applicant, True)
+        explanation = pd.DataFrame(npCBA.explain(model, np_rules[0]), columns=list(r_table.columns))
+
+        assert np_predictions[0] == r_prediction
+        assert len(explanation) == len(r_table)
+        for column in r_table.columns:
+            expected = [None if pd.isna(v) else v for v in r_table[column]]
+            actual = [None if pd.isna(v) else v for v in explanation[column]]
+            if all(isinstance(v, (int, float)) or v is None for v in expected):
+                assert np.allclose([np.nan if v is None else float(v) for v in actual],
+                                   [np.nan if v is None else float(v) for v in expected], equal_nan=True), column
+            else:
+                assert [None if v is None else str(v) for v in actual] == \
+                       [None if v is None else str(v) for v in expected], column
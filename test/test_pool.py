@@ -0,0 +1,29 @@
+import asyncio
+import pandas as pd
+import npCBA
+from pool import InferencePool, predict, predict_many
+from test_npCBA import toy_model
+
+
+def test_workers_predict_with_the_shared_model(tmp_path):
+    path = str(tmp_path / "engine_v1")
+    npCBA.save_model(toy_model(), path)
+    pool = InferencePool(None, workers=2)
+    # The model is already exported, the workers attach to it without R
+    pool.model_path = path
+    applicants = pd.DataFrame({"Age": ["(0~30]", "(30~60]", "(30~60]"], "Job": ["a", "b", "a"]})
+
+    async def scenario():
+        single = await pool.run(predict, applicants.iloc[[1]], True)
+        many = await pool.run_many(predict_many, [(applicants.iloc[[i]], True) for i in range(3)])
+        return single, many, await pool.model_version()
+
+    pool.start()
+    try:
+        single, many, version = asyncio.run(scenario())
+    finally:
+        pool.stop()
+    assert single == ("good", [1])
+    assert many == [(["bad"], [[0]]), (["good"], [[1]]), (["good"], [[]])]
+    assert version == "v1"
+    assert pool.status()["waiting"] == 0 and pool.status()["in_flight"] == 0
@@ -0,0 +1,54 @@
+import pandas as pd
+from Preprocesamiento import utils
+
+
+def raw_data():
+    return pd.DataFrame({
+        'Status of existing checking account': ['A11', 'A14', 'A12', 'A13', 'A11'],
+        'Duration in month': [6, 48, 12, 42, 24],
+        'Purpose': ['A43', 'A410', 'A46', 'A42', 'A40'],
+        'Personal status and sex': ['A93', 'A92', 'A93', 'A91', 'A95'],
+        'Job': ['A173', 'A173', 'A172', 'A174', 'A171'],
+        'Class': [1, 2, 1, 1, 2]
+    })
+
+
+def test_chunks_are_preprocessed_as_the_whole_file(tmp_path):
+    raw = raw_data()
+    raw.to_csv(tmp_path / 'raw.csv', index=False)
+    expected = utils.split_personal_status_and_sex(utils.replace_categorical_values(raw.copy()))
+
+    # Chunks that do not contain every code of an attribute still get all its categories
+    assert utils.preprocess_file(str(tmp_path / 'raw.csv'), str(tmp_path / 'data.csv'), chunksize=2) == 5
+    assert utils.preprocess_file(str(tmp_path / 'raw.csv'), str(tmp_path / 'data.parquet'), chunksize=2) == 5
+    from_csv = pd.read_csv(tmp_path / 'data.csv')
+    from_parquet = utils.load_data(str(tmp_path / 'data.parquet'))
+
+    assert list(from_csv.columns) == list(expected.columns)
+    assert from_csv['Purpose'].tolist() == ['radio/television', 'others', 'education', 'furniture/equipment', 'car (new)']
+    assert from_csv['Gender'].tolist() == ['male', 'female', 'male', 'male', 'female']
+    assert from_csv['Marital Status'].tolist() == expected['Marital Status'].astype(str).tolist()
+    pd.testing.assert_frame_equal(from_parquet, expected.reset_index(drop=True))
+    assert len(list(utils.read_chunks(str(tmp_path / 'data.parquet'), chunksize=2))) == 3
+
+
+def test_unknown_codes_are_missing():
+    data = utils.replace_categorical_values(pd.DataFrame({'Job': ['A173', 'A999']}))
+    assert data['Job'].tolist()[0] == 'skilled employee'
+    assert pd.isna(data['Job'].tolist()[1])
+
+
+def test_categories_survive_parquet_and_feather(tmp_path):
+    data = pd.DataFrame({'Class': pd.Categorical(['bad', 'good', 'good'], categories=['good', 'bad']),
+                         'Job': ['skilled employee', 'unemployed/non-resident', 'skilled employee'],
+                         'Age': [25, 40, 61]})
+    for name in ['data.parquet', 'data.feather']:
+        path = str(tmp_path / name)
+        utils.save_data(data, path)
+        read = utils.load_data(path)
+        # The levels keep their order, and the text columns come back as categorical columns
+        assert read['Class'].cat.categories.tolist() == ['good', 'bad']
+        assert read['Class'].tolist() == ['bad', 'good', 'good']
+        assert isinstance(read['Job'].dtype, pd.CategoricalDtype)
+        assert read['Job'].tolist() == data['Job'].tolist()
+        assert read['Age'].tolist() == [25, 40, 61]
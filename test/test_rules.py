@@ -0,0 +1,51 @@
+import os
+from fastapi.testclient import TestClient
+import main
+import npCBA
+from test_npCBA import toy_model
+
+
+def test_rule_ids_do_not_depend_on_the_position_of_the_rule():
+    first = toy_model()
+    # The same rules in the opposite order, with the items of the second rule swapped
+    second = npCBA.build_model(item_labels=first["item_labels"], rule=[1, 1, 2], item=["Job=b", "Age=(30~60]", "Age=(0~30]"],
+                               rhs=["Class=good", "Class=bad"], support=[0.3, 0.2], confidence=[0.9, 0.8],
+                               weights=[1.0, 1.0], default="good", method="majority", version="v2")
+    assert first["rule_ids"].tolist() == second["rule_ids"].tolist()[::-1]
+    assert first["rule_ids"][1] == npCBA.rule_id(["Job=b", "Age=(30~60]"], "Class=good")
+    assert len(set(first["rule_ids"])) == 2 and all(len(i) == 16 for i in first["rule_ids"])
+    assert npCBA.rule_id(["Age=(0~30]"], "Class=bad") != npCBA.rule_id(["Age=(0~30]"], "Class=good")
+
+
+def test_catalog_resolves_the_rule_ids():
+    model = toy_model()
+    catalog = npCBA.catalog(model)
+    assert (catalog["version"], catalog["default"], catalog["method"]) == ("v1", "good", "majority")
+    assert catalog["rules"][1] == {"id": str(model["rule_ids"][1]), "lhs": {"Age": "(30~60]", "Job": "b"},
+                                   "class": "good", "weight": 1.0, "support": 0.3, "confidence": 0.9}
+    prepared = npCBA.prepare_model(model)
+    ids = [c["id"] for c in npCBA.contributions(prepared, [1, 0])]
+    assert ids == npCBA.rule_keys(prepared, [1, 0]) == [r["id"] for r in catalog["rules"][::-1]]
+
+
+def test_rules_are_revalidated_with_the_etag(tmp_path, monkeypatch):
+    npCBA.save_model(toy_model(), str(tmp_path / "engine_v1"))
+    monkeypatch.setattr(main.pool, "model_dir", str(tmp_path))
+    monkeypatch.setattr(main.app.state, "version", "v1", raising=False)
+    client = TestClient(main.app)
+
+    response = client.get("/rules")
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"v1"' and response.headers["cache-control"] == "no-cache"
+    assert response.json() == npCBA.catalog(npCBA.load_model(str(tmp_path / "engine_v1")))
+
+    response = client.get("/rules", headers={"If-None-Match": 'W/"v0", "v1"'})
+    assert response.status_code == 304 and response.content == b""
+
+    # Models saved without their catalog get it built from the arrays
+    os.remove(tmp_path / "engine_v1" / npCBA.CATALOG_FILE)
+    response = client.get("/rules/v1")
+    assert response.status_code == 200 and "immutable" in response.headers["cache-control"]
+    assert response.json()["rules"][0]["lhs"] == {"Age": "(0~30]"}
+    assert client.get("/rules/v2").status_code == 404
+    assert client.get("/rules/..%2Fv1").status_code == 404